@@ -1,43 +1,67 @@
+import gzip
+import hashlib
+import io
+import json
 import os
+import queue
+import struct
+import threading
 import time
-from datetime import datetime, timezone
+from collections.abc import Generator, Iterator, Sequence
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from dataclasses import asdict, dataclass, replace
+from datetime import date, datetime, timezone
 from pathlib import Path
-from typing import Any, Generator
+from typing import IO, TYPE_CHECKING, Any, TypeVar
 
 import polars as pl
-import requests
 
-from common import Cmd, Symbol, p, ts, zx
-from fs import Block, Store
+import ingest
+from common import Action, Cmd, Symbol, lazy, p
+from fs import Block, Store, fingerprint, format_ts
 
+if TYPE_CHECKING:
+    import requests
+else:
+    requests = lazy("requests")
 
-class Import(Cmd):
-    def run(self, *args, **kwargs) -> tuple[int | None, str | Exception | None]:
-        symbols: dict[str, Symbol] | None = kwargs.get("symbols")
-        if not symbols:
-            return None, None
-        path: str | os.PathLike[str] | None = kwargs.get("path")
-        path = path if path is not None else ""
-        store = Store(path)
-        for arg in args:
-            sym, err = self._parse_arg(arg)
-            if err is not None:
-                return 1, err
-            if sym.lower() not in symbols:
-                p(f"Skipping {arg}")
-                continue
-            p(f"Processing {arg}... ", end="")
-            err = self._process_arg(arg, symbols[sym.lower()], store)
-            if err is not None:
-                p()
-                return 2, err
-            p("done.")
-        return None, None
+try:
+    from orjson import loads  # type: ignore[import-not-found]
+except ImportError:
+    from json import loads  # type: ignore[assignment]
 
+T = TypeVar("T")
+
+VALUES = ["price", "b", "s", "m", "l"]
+EMPTY = pl.DataFrame(
+    schema={"dt": pl.Datetime("us", "UTC")} | {c: pl.Utf8 for c in VALUES} | {"id": pl.Int64}
+)
+COLUMNS = [
+    ("price", 0, pl.Utf8),
+    ("volume", 1, pl.Utf8),
+    ("time", 2, pl.Float64),
+    ("side", 3, pl.Utf8),
+    ("type", 4, pl.Utf8),
+    ("id", 6, pl.Int64),
+]
+TRADES = [
+    (pl.col("time") * 1_000_000).round().cast(pl.Int64).cast(pl.Datetime("us", "UTC")).alias("dt"),
+    pl.col("price"),
+    pl.when(pl.col("side") == "b").then(pl.col("volume")).otherwise(pl.lit("0")).alias("b"),
+    pl.when(pl.col("side") == "s").then(pl.col("volume")).otherwise(pl.lit("0")).alias("s"),
+    pl.when(pl.col("type") == "m").then(pl.col("volume")).otherwise(pl.lit("0")).alias("m"),
+    pl.when(pl.col("type") == "l").then(pl.col("volume")).otherwise(pl.lit("0")).alias("l"),
+    pl.col("id"),
+]
+LOGS = {"csv": ".csv", "ipc": ".arrows"}
+FRAME = struct.Struct("<Q")
+
+
+class Import(ingest.Import):
     @staticmethod
     def _parse_arg(arg: str) -> tuple[str, Exception | None]:
         try:
-            prefix, sym, _ = Path(arg).stem.split(".", maxsplit=2)
+            prefix, sym, _ = ingest.stem(arg).split(".", maxsplit=2)
             if prefix == "kraken":
                 return sym, None
             return "", ValueError(f"unexpected: {arg}")
@@ -46,203 +70,393 @@ class Import(Cmd):
 
     @staticmethod
     def _process_arg(arg: str, symbol: Symbol, store: Store) -> Exception | None:
-        try:
-            reader = pl.read_csv_batched(
-                arg,
-                has_header=False,
-                low_memory=True,
-                infer_schema_length=0,
-                columns=list(range(6)),
-                new_columns=["ts", "price", "b", "s", "m", "l"],
-                batch_size=10000,
-                rechunk=False,
-            )
-        except OSError as err:
-            return err
-        except Exception as err:
-            return err
+        source = fingerprint(arg)
+        written: list[int] = []
 
-        acc_df: pl.DataFrame | None = None
-        acc_y: int | None = None
-        acc_m: int | None = None
+        def emit(start: date, df: pl.DataFrame) -> Exception | None:
+            written.append(start.year * 12 + start.month - 1)
+            return Import._process_month(df, symbol, store, start, source)
 
-        while True:
-            batches = reader.next_batches(1)
-            if batches is None:
-                break
-            try:
-                batch = (
-                    batches[0]
-                    .with_columns(pl.col("ts").str.to_datetime(time_zone="UTC").alias("dt"))
-                    .with_columns(pl.col("price").cast(pl.Float32).alias("price_value"))
-                )
-            except Exception as err:
-                return err
+        months = ingest.Months(emit, key="month")
+        every = symbol.intervals[0] if symbol.intervals is not None else "23s"
+        scale = symbol.scale if symbol.scale is not None else ingest.SCALE
+        bars = ingest.Bars(every, lambda df: Import._aggregate(df, every), months.push, group_by="month")
 
-            try:
-                times = batch["dt"].to_list()
-            except Exception as err:
-                return err
-
-            if not times:
-                continue
+        ckpt_path = store.path / f".{Path(arg).name}.checkpoint"
+        compressed = ingest.compressed(arg)
+        ckpt = None if compressed else Import._load_checkpoint(ckpt_path, arg, symbol, store)
+        open_month: int | None = None
+        offset = end = last_id = 0
 
-            start_idx, n_rows = 0, len(times)
+        try:
+            with ingest.open_source(arg) as f:
+                if ckpt is not None:
+                    f.seek(ckpt.offset)
+                for batch_offset, end, batch in Import._read_log(f, is_ipc(arg)):
+                    batch, err_ = Import._prepare(batch, arg, scale)
+                    if err_ is not None:
+                        return err_
+                    if ckpt is not None and batch_offset == ckpt.offset:
+                        batch = batch.filter(pl.col("month") >= ckpt.month)
+                    if batch.height == 0:
+                        continue
+                    last_month = batch.item(-1, "month")
+                    if open_month is None or last_month > open_month:
+                        open_month, offset = last_month, batch_offset
+                    last_id = batch.item(-1, "id")
 
-            while start_idx < n_rows:
-                y = times[start_idx].year
-                m = times[start_idx].month
+                    err_ = bars.push(batch)
+                    if err_ is not None:
+                        return err_
+        except OSError as err:
+            return err
+        except Exception as err:
+            return err
 
-                idx = start_idx
-                while idx < n_rows and times[idx].year == y and times[idx].month == m:
-                    idx += 1
+        err_ = bars.close()
+        if err_ is not None:
+            return err_
+        err_ = months.close()
+        if err_ is not None:
+            return err_
+        if open_month is None or compressed:
+            return None
+        err_ = store.flush()
+        if err_ is not None:
+            return err_
+        closed = sorted(
+            {m for m in written + (ckpt.months or [] if ckpt is not None else []) if m < open_month}
+        )
+        return Import._save_checkpoint(
+            ckpt_path,
+            Checkpoint(offset, end, last_id, open_month, symbol.intervals, scale, store.format, closed),
+        )
 
-                part = batch.slice(start_idx, idx - start_idx)
+    @staticmethod
+    def _prepare(batch: pl.DataFrame, name: str, scale: int) -> tuple[pl.DataFrame, Exception | None]:
+        if batch.select(ingest.check_fixed(VALUES, scale)).item():
+            return batch, ValueError(f"more than {scale} decimals in {name}")
+        batch = batch.with_columns(
+            *[ingest.parse_fixed(c, scale) for c in VALUES],
+        ).with_columns(
+            (pl.col("dt").dt.year() * 12 + pl.col("dt").dt.month() - 1).alias("month"),
+        )
+        return batch, None
 
-                if acc_df is None:
-                    acc_df, acc_y, acc_m = part, y, m
-                elif acc_y == y and acc_m == m:
-                    try:
-                        acc_df = acc_df.vstack(part)
-                    except Exception as err:
-                        return err
-                else:
-                    err_ = Import._process_month(acc_df, symbol, store)
-                    if err_ is not None:
-                        return err_
-                    acc_df, acc_y, acc_m = part, y, m
+    @staticmethod
+    def _read_log(f: IO[bytes], ipc: bool) -> Iterator[tuple[int, int, pl.DataFrame]]:
+        if ipc:
+            yield from read_frames(f)
+            return
+        for offset, end, batch in ingest.read_batches(
+            f,
+            columns=list(range(7)),
+            new_columns=["ts", "price", "b", "s", "m", "l", "id"],
+            infer_schema=False,
+            schema_overrides={"id": pl.Int64},
+        ):
+            yield offset, end, batch.with_columns(pl.col("ts").str.to_datetime(time_zone="UTC").alias("dt"))
 
-                start_idx = idx
+    @staticmethod
+    def _load_checkpoint(path: Path, arg: str, symbol: Symbol, store: Store) -> "Checkpoint | None":
+        try:
+            with open(path, "r") as f:
+                ckpt = Checkpoint(**json.load(f))
+            scale = symbol.scale if symbol.scale is not None else ingest.SCALE
+            if (
+                ckpt.intervals != symbol.intervals
+                or ckpt.scale != scale
+                or ckpt.format != store.format
+                or ckpt.months is None
+                or os.path.getsize(arg) < ckpt.size
+            ):
+                return None
+            stored = {
+                (entry.month, entry.interval)
+                for entry in store.entries(symbol.name, symbol.market)
+                if entry.format == store.format
+            }
+            intervals: list[str | None] = list(symbol.intervals) if symbol.intervals is not None else [None]
+            for month in ckpt.months:
+                if any((f"{month // 12:04d}-{month % 12 + 1:02d}", i) not in stored for i in intervals):
+                    return None
+            _, last_id, err = Fetch._parse_last_record(arg, ckpt.size)
+            if err is not None or last_id != ckpt.last_id:
+                return None
+            return ckpt
+        except (OSError, ValueError, TypeError):
+            return None
 
-        if acc_df is not None:
-            err_ = Import._process_month(acc_df, symbol, store)
-            if err_ is not None:
-                return err_
+    @staticmethod
+    def _save_checkpoint(path: Path, ckpt: "Checkpoint") -> Exception | None:
+        try:
+            tmp = path.with_name(path.name + ".tmp")
+            with open(tmp, "w") as f:
+                json.dump(asdict(ckpt), f)
+            os.replace(tmp, path)
+            return None
+        except OSError as err:
+            return err
 
-        return None
+    @staticmethod
+    def _aggregate(df: pl.DataFrame, every: str) -> pl.DataFrame:
+        return df.group_by_dynamic(index_column="dt", every=every, closed="left", group_by="month").agg(
+            pl.col("price").first().alias("open"),
+            pl.col("price").max().alias("high"),
+            pl.col("price").min().alias("low"),
+            pl.col("price").last().alias("close"),
+            pl.col("b").sum().alias("b_value"),
+            pl.col("s").sum().alias("s_value"),
+            pl.col("m").sum().alias("m_value"),
+            pl.col("l").sum().alias("l_value"),
+            (pl.col("b") != 0).cast(pl.UInt32).sum().alias("b_count"),
+            (pl.col("s") != 0).cast(pl.UInt32).sum().alias("s_count"),
+            (pl.col("m") != 0).cast(pl.UInt32).sum().alias("m_count"),
+            (pl.col("l") != 0).cast(pl.UInt32).sum().alias("l_count"),
+        )
 
     @staticmethod
     def _process_month(
         df: pl.DataFrame,
         symbol: Symbol,
         store: Store,
+        start: date,
+        source: str | None = None,
     ) -> Exception | None:
-        df = (
-            df.group_by_dynamic(index_column="dt", every="23s", closed="left")
-            .agg(
-                pl.col("price").first().alias("open"),
-                pl.col("price")
-                .filter(pl.col("price_value") == pl.col("price_value").max())
-                .first()
-                .alias("high"),
-                pl.col("price")
-                .filter(pl.col("price_value") == pl.col("price_value").min())
-                .first()
-                .alias("low"),
-                pl.col("price").last().alias("close"),
-                pl.col("b").cast(pl.Float64).sum().alias("b_value"),
-                pl.col("s").cast(pl.Float64).sum().alias("s_value"),
-                pl.col("m").cast(pl.Float64).sum().alias("m_value"),
-                pl.col("l").cast(pl.Float64).sum().alias("l_value"),
-                (pl.col("b") != "0").cast(pl.UInt32).sum().alias("b_count"),
-                (pl.col("s") != "0").cast(pl.UInt32).sum().alias("s_count"),
-                (pl.col("m") != "0").cast(pl.UInt32).sum().alias("m_count"),
-                (pl.col("l") != "0").cast(pl.UInt32).sum().alias("l_count"),
+        df = df.drop("month")
+        scale = symbol.scale if symbol.scale is not None else ingest.SCALE
+        intervals: list[str | None] = list(symbol.intervals) if symbol.intervals is not None else [None]
+        for interval in intervals:
+            bars = df if interval is None or interval == intervals[0] else ingest.rollup(df, interval)
+            bars = bars.with_columns(
+                ingest.format_fixed(c, scale)
+                for c in ("open", "high", "low", "close", "b_value", "s_value", "m_value", "l_value")
             )
-            .with_columns(
-                pl.when(pl.col("b_value") == pl.col("b_value").cast(pl.Int64).cast(pl.Float64))
-                .then(pl.col("b_value").cast(pl.Int64).cast(pl.Utf8))
-                .otherwise(pl.col("b_value").cast(pl.Utf8))
-                .alias("b_value"),
-                pl.when(pl.col("s_value") == pl.col("s_value").cast(pl.Int64).cast(pl.Float64))
-                .then(pl.col("s_value").cast(pl.Int64).cast(pl.Utf8))
-                .otherwise(pl.col("s_value").cast(pl.Utf8))
-                .alias("s_value"),
-                pl.when(pl.col("m_value") == pl.col("m_value").cast(pl.Int64).cast(pl.Float64))
-                .then(pl.col("m_value").cast(pl.Int64).cast(pl.Utf8))
-                .otherwise(pl.col("m_value").cast(pl.Utf8))
-                .alias("m_value"),
-                pl.when(pl.col("l_value") == pl.col("l_value").cast(pl.Int64).cast(pl.Float64))
-                .then(pl.col("l_value").cast(pl.Int64).cast(pl.Utf8))
-                .otherwise(pl.col("l_value").cast(pl.Utf8))
-                .alias("l_value"),
-            )
-        )
-        err = store.put(Block(symbol.name, symbol.market, df.item(1, "dt"), df))
-        if err is not None:
-            return err
+            err = store.put(Block(symbol.name, symbol.market, start, bars, source, interval))
+            if err is not None:
+                return err
         return None
 
 
 class Fetch(Cmd):
+    VERB = "Fetching"
+
+    def __init__(self, limiter: "Limiter | None" = None) -> None:
+        self._limiter = limiter if limiter is not None else Limiter()
+        self._cache: PageCache | None = None
+        self._replay = False
+
     def run(self, *args, **kwargs) -> tuple[int | None, str | Exception | None]:
         symbols: dict[str, Symbol] | None = kwargs.get("symbols")
         if not symbols:
             return None, None
-        if not args:
+        jobs, rest, jobs_err = ingest.parse_jobs(args, default=0)
+        if jobs_err is not None:
+            return 1, jobs_err
+        self._cache, self._replay, rest, cache_err = parse_cache(rest)
+        if cache_err is not None:
+            return 1, cache_err
+        segments, rest, backfill_err = parse_backfill(rest)
+        if backfill_err is not None:
+            return 1, backfill_err
+        if not rest:
             return 1, "dl path?"
 
-        self._dl, self._client = Path(args[0]), Client()
+        action: Action | None = kwargs.get("action")
+        self._dl, self._jobs, self._segments = Path(rest[0]), jobs, segments
+        self._log = action.log if action is not None and action.log is not None else "csv"
+        return self._run(symbols, jobs or 1)
 
+    def _run(self, symbols: dict[str, Symbol], jobs: int) -> tuple[int | None, str | Exception | None]:
         for symbol in symbols.values():
             assert symbol.market == "Kraken"
 
-            err = self._fetch_symbol(symbol)
-            if err is not None:
-                return 2, err
+        started = time.monotonic()
+        if jobs > 1 and len(symbols) > 1:
+            code, err = self._run_parallel(list(symbols.values()), jobs)
+        else:
+            code, err, client = None, None, self._client()
+            for symbol in symbols.values():
+                p(f"{self.VERB} {symbol.market}:{symbol.name}... ", end="")
+                err = self._fetch_symbol(symbol, client)
+                if err is not None:
+                    p()
+                    code = 2
+                    break
+                p("done.")
+        self._report(started)
+        return code, err
 
+    def _run_parallel(self, symbols: list[Symbol], jobs: int) -> tuple[int | None, str | Exception | None]:
+        failed = 0
+        with ThreadPoolExecutor(min(jobs, len(symbols))) as pool:
+            futures = {
+                pool.submit(self._fetch_symbol, symbol, self._client()): symbol for symbol in symbols
+            }
+            for future in as_completed(futures):
+                symbol = futures[future]
+                try:
+                    err = future.result()
+                except Exception as e:
+                    err = e
+                if err is not None:
+                    p(f"{self.VERB} {symbol.market}:{symbol.name}... failed: {err}")
+                    failed += 1
+                else:
+                    p(f"{self.VERB} {symbol.market}:{symbol.name}... done.")
+        if failed:
+            return 2, f"{failed} of {len(symbols)} symbols failed"
         return None, None
 
-    def _fetch_symbol(self, symbol: Symbol) -> str | Exception | None:
-        assert symbol.start is not None
+    def _client(self) -> "Client":
+        return Client(self._limiter, self._cache, self._replay)
 
-        p(f"Fetching {symbol.market}:{symbol.name}... ", end="")
+    def _report(self, started: float) -> None:
+        elapsed, n = time.monotonic() - started, self._limiter.requests
+        if n > 0 and elapsed > 0:
+            p(f"{n} requests in {elapsed:.1f}s, {n / elapsed:.2f} req/s")
+        if self._cache is not None and self._cache.hits > 0:
+            p(f"{self._cache.hits} pages from cache, {self._cache.size >> 20} MiB cached")
+
+    def _fetch_symbol(self, symbol: Symbol, client: "Client") -> str | Exception | None:
+        assert symbol.start is not None
 
         try:
-            outpath = self._dl / f"kraken.{symbol.name.lower()}.trades.csv"
-            if outpath.exists():
-                start, last_id, err = self._parse_last_record(outpath)
-                if err is not None:
-                    p()
-                    return err
-                if start == 0:
-                    start = symbol.start.timestamp()
-            else:
-                self._dl.mkdir(mode=0o755, parents=True, exist_ok=True)
-                with open(outpath, "w") as f:
-                    pass
-                os.chmod(outpath, 0o644)
-                start, last_id = symbol.start.timestamp(), 0
-
-            with open(outpath, "a") as outfile:
-                for trades, err in self._client._fetch_trades(symbol.name.upper(), start, last_id):
+            outpath, start, last_id, err = self._open_log(self._dl, symbol)
+            if err is not None:
+                return err
+
+            planpath = outpath.with_name(f".{outpath.name}.backfill")
+            if self._segments > 1 or planpath.exists():
+                start, last_id, backfill_err = self._backfill(symbol, outpath, planpath, start, last_id)
+                if backfill_err is not None:
+                    return backfill_err
+
+            with open(outpath, "ab") as outfile:
+                for trades, err in prefetch(client._fetch_trades(symbol.name.upper(), start, last_id)):
                     if err is not None:
-                        p()
                         return err
-                    for trade in trades:
-                        outfile.write(
-                            ",".join(
-                                [ts(datetime.fromtimestamp(trade[0], tz=timezone.utc))]
-                                + [zx(s) for s in trade[1:-1]]
-                                + [str(trade[-1])]
-                            )
-                            + "\n"
-                        )
-                    outfile.flush()
+                    self._write_trades(outfile, trades)
 
         except OSError as err:
-            p()
             return err
 
-        p("done.")
+        return None
+
+    def _open_log(self, dl: Path, symbol: Symbol) -> tuple[Path, float, int, Exception | None]:
+        assert symbol.start is not None
+        outpath = dl / f"kraken.{symbol.name.lower()}.trades{LOGS[self._log]}"
+        if outpath.exists():
+            start, last_id, err = self._parse_last_record(outpath)
+            if start == 0:
+                start = symbol.start.timestamp()
+            return outpath, start, last_id, err
+        dl.mkdir(mode=0o755, parents=True, exist_ok=True)
+        with open(outpath, "wb") as f:
+            pass
+        os.chmod(outpath, 0o644)
+        return outpath, symbol.start.timestamp(), 0, None
+
+    def _backfill(
+        self, symbol: Symbol, outpath: Path, planpath: Path, start: float, last_id: int
+    ) -> tuple[float, int, str | Exception | None]:
+        try:
+            with open(planpath, "r") as f:
+                bounds = json.load(f)["bounds"]
+        except FileNotFoundError:
+            end = time.time()
+            step = (end - start) / self._segments
+            bounds = [start] + [round(start + i * step) for i in range(1, self._segments)] + [end]
+            tmp = planpath.with_name(planpath.name + ".tmp")
+            with open(tmp, "w") as f:
+                json.dump({"bounds": bounds}, f)
+            os.replace(tmp, planpath)
+        except (ValueError, KeyError) as err:
+            return 0, 0, ValueError(f"bad backfill plan {planpath}: {err}")
+
+        parts = [outpath.with_name(f".{outpath.name}.{i}") for i in range(len(bounds) - 1)]
+        todo = [i for i, part in enumerate(parts) if not part.exists()]
+        failed: list[str | Exception] = []
+        workers = min(self._jobs, len(todo)) if self._jobs > 0 else len(todo)
+        with ThreadPoolExecutor(max(1, workers)) as pool:
+            futures = [
+                pool.submit(self._fetch_segment, symbol, parts[i], bounds[i], bounds[i + 1], self._client())
+                for i in todo
+            ]
+            for future in as_completed(futures):
+                try:
+                    seg_err = future.result()
+                except Exception as e:
+                    seg_err = e
+                if seg_err is not None:
+                    failed.append(seg_err)
+        if failed:
+            return 0, 0, f"{len(failed)} of {len(todo)} segments failed: {failed[0]}"
+
+        with open(outpath, "ab") as outfile:
+            for part in parts:
+                with open(part, "rb") as f:
+                    last_id = self._copy_trades(f, outfile, last_id)
+            outfile.flush()
+            os.fsync(outfile.fileno())
+        for part in parts:
+            os.remove(part)
+        os.remove(planpath)
+
+        start, last_id, parse_err = self._parse_last_record(outpath)
+        return start if start != 0 else bounds[-1], last_id, parse_err
 
+    def _fetch_segment(
+        self, symbol: Symbol, part: Path, start: float, end: float, client: "Client"
+    ) -> str | Exception | None:
+        tmp, last_id = part.with_name(part.name + ".part"), 0
+        if tmp.exists():
+            since, last_id, err = self._parse_last_record(tmp)
+            if err is not None:
+                return err
+            if since != 0:
+                start = since
+        with open(tmp, "ab") as outfile:
+            for trades, err in prefetch(client._fetch_trades(symbol.name.upper(), start, last_id, end)):
+                if err is not None:
+                    return err
+                self._write_trades(outfile, trades)
+        os.replace(tmp, part)
         return None
 
+    def _write_trades(self, outfile: IO[bytes], trades: pl.DataFrame) -> None:
+        if self._log == "ipc":
+            write_frame(outfile, trades)
+        else:
+            trades.select(
+                format_ts("dt", trades.schema["dt"]), *[strip_zeros(c) for c in VALUES], "id"
+            ).write_csv(outfile, include_header=False)
+        outfile.flush()
+
+    def _copy_trades(self, f: IO[bytes], outfile: IO[bytes], last_id: int) -> int:
+        if self._log == "ipc":
+            for _, _, df in read_frames(f):
+                df = df.filter(pl.col("id") > last_id)
+                if df.height > 0:
+                    write_frame(outfile, df)
+                    last_id = df.item(-1, "id")
+            return last_id
+        for line in f:
+            trade_id = int(line.rsplit(b",", 1)[1])
+            if trade_id > last_id:
+                outfile.write(line)
+                last_id = trade_id
+        return last_id
+
     @staticmethod
-    def _parse_last_record(path: str | os.PathLike[str]) -> tuple[float, int, Exception | None]:
+    def _parse_last_record(
+        path: str | os.PathLike[str],
+        end: int | None = None,
+    ) -> tuple[float, int, Exception | None]:
+        if is_ipc(path):
+            return parse_last_frame(path, end)
         with open(path, "rb") as f:
-            f.seek(0, 2)
-            size = f.tell()
+            size = end if end is not None else f.seek(0, 2)
             if size == 0:
                 return 0, 0, None
             start = max(0, size - 4096)
@@ -268,32 +482,405 @@ class Fetch(Cmd):
         return 0, 0, None
 
 
-TradeRecord = tuple[
-    float,  # timestamp
-    str,  # price
-    str,  # buy volume
-    str,  # sell volume
-    str,  # market volume
-    str,  # limit volume
-    int,  # trade id
-]
+class Sync(Fetch):
+    VERB = "Syncing"
+
+    def run(self, *args, **kwargs) -> tuple[int | None, str | Exception | None]:
+        symbols: dict[str, Symbol] | None = kwargs.get("symbols")
+        if not symbols:
+            return None, None
+        jobs, rest, jobs_err = ingest.parse_jobs(args)
+        if jobs_err is not None:
+            return 1, jobs_err
+        self._cache, self._replay, rest, cache_err = parse_cache(rest)
+        if cache_err is not None:
+            return 1, cache_err
+
+        path: str | os.PathLike[str] | None = kwargs.get("path")
+        action: Action | None = kwargs.get("action")
+        self._log_dl = Path(rest[0]) if rest else None
+        self._jobs, self._segments = jobs, 0
+        self._log = action.log if action is not None and action.log is not None else "csv"
+        self._intervals = action.intervals if action is not None else None
+        path = path if path is not None else ""
+        if action is not None:
+            self._store = Store(path, action.format, action.writers, True)
+        else:
+            self._store = Store(path, merge=True)
+
+        code, err = self._run(symbols, jobs)
+        store_err = self._store.close()
+        if err is None and store_err is not None:
+            return 2, store_err
+        return code, err
+
+    def _fetch_symbol(self, symbol: Symbol, client: "Client") -> str | Exception | None:
+        if symbol.intervals is None and self._intervals is not None:
+            symbol = replace(symbol, intervals=self._intervals)
+        assert symbol.start is not None
+        every = symbol.intervals[0] if symbol.intervals is not None else "23s"
+        scale = symbol.scale if symbol.scale is not None else ingest.SCALE
+        months = ingest.Months(
+            lambda start, df: Import._process_month(df, symbol, self._store, start), key="month"
+        )
+        bars = ingest.Bars(every, lambda df: Import._aggregate(df, every), months.push, group_by="month")
+
+        resume = self._resume(symbol)
+        start = resume.timestamp() - 1 if resume is not None else symbol.start.timestamp()
+        log: IO[bytes] | None = None
+        log_id = 0
+        try:
+            if self._log_dl is not None:
+                outpath, _, log_id, err = self._open_log(self._log_dl, symbol)
+                if err is not None:
+                    return err
+                log = open(outpath, "ab")
+            for trades, err in prefetch(client._fetch_trades(symbol.name.upper(), start)):
+                if err is not None:
+                    return err
+                if log is not None:
+                    new = trades.filter(pl.col("id") > log_id)
+                    if new.height > 0:
+                        self._write_trades(log, new)
+                        log_id = new.item(-1, "id")
+                if resume is not None:
+                    trades = trades.filter(pl.col("dt") >= resume)
+                batch, err = Import._prepare(trades, symbol.name, scale)
+                if err is None:
+                    err = bars.push(batch)
+                if err is not None:
+                    return err
+        except OSError as err:
+            return err
+        finally:
+            if log is not None:
+                log.close()
+
+        err_ = bars.close()
+        if err_ is not None:
+            return err_
+        return months.close()
+
+    def _resume(self, symbol: Symbol) -> datetime | None:
+        intervals: list[str | None] = list(symbol.intervals) if symbol.intervals is not None else [None]
+        ends: dict[str | None, str] = {}
+        for entry in self._store.entries(symbol.name, symbol.market):
+            if entry.end is not None and entry.interval in intervals:
+                ends[entry.interval] = max(ends.get(entry.interval, entry.end), entry.end)
+        if len(ends) < len(intervals):
+            return None
+        return min(datetime.fromisoformat(end) for end in ends.values())
+
+
+def prefetch(items: Iterator[T], depth: int = 2) -> Iterator[T]:
+    q: queue.Queue[tuple[bool, Any]] = queue.Queue(depth)
+    stop = threading.Event()
+
+    def put(item: tuple[bool, Any]) -> bool:
+        while not stop.is_set():
+            try:
+                q.put(item, timeout=0.1)
+                return True
+            except queue.Full:
+                pass
+        return False
+
+    def produce() -> None:
+        try:
+            for item in items:
+                if not put((False, item)):
+                    return
+        except BaseException as err:
+            put((True, err))
+            return
+        finally:
+            if isinstance(items, Generator):
+                items.close()
+        put((True, None))
+
+    threading.Thread(target=produce, daemon=True).start()
+    try:
+        while True:
+            end, item = q.get()
+            if end:
+                if item is not None:
+                    raise item
+                return
+            yield item
+    finally:
+        stop.set()
+
+
+def is_ipc(path: str | os.PathLike[str]) -> bool:
+    return LOGS["ipc"] in Path(path).suffixes
+
+
+def strip_zeros(name: str) -> pl.Expr:
+    col = pl.col(name)
+    stripped = col.str.strip_chars_end("0").str.strip_chars_end(".")
+    return (
+        pl.when(~col.str.contains(".", literal=True))
+        .then(col)
+        .when(stripped == "")
+        .then(pl.lit("0"))
+        .otherwise(stripped)
+        .alias(name)
+    )
+
+
+def write_frame(f: IO[bytes], df: pl.DataFrame) -> None:
+    buf = io.BytesIO()
+    df.write_ipc_stream(buf, compression="zstd")
+    n = FRAME.pack(buf.tell())
+    f.write(n + buf.getvalue() + n)
+
+
+def read_frames(f: IO[bytes]) -> Iterator[tuple[int, int, pl.DataFrame]]:
+    offset = f.tell()
+    while True:
+        head = f.read(FRAME.size)
+        if not head:
+            return
+        n = FRAME.unpack(head)[0] if len(head) == FRAME.size else -1
+        payload = f.read(n) if n >= 0 else b""
+        if n < 0 or len(payload) != n or f.read(FRAME.size) != head:
+            raise ValueError(f"bad frame at {offset}")
+        end = offset + n + 2 * FRAME.size
+        yield offset, end, pl.read_ipc_stream(io.BytesIO(payload))
+        offset = end
+
+
+def parse_last_frame(
+    path: str | os.PathLike[str], end: int | None = None
+) -> tuple[float, int, Exception | None]:
+    with open(path, "rb") as f:
+        size = end if end is not None else f.seek(0, 2)
+        if size == 0:
+            return 0, 0, None
+        if size < 2 * FRAME.size:
+            return 0, 0, ValueError(f"bad frame at end of {path}")
+        f.seek(size - FRAME.size)
+        n = FRAME.unpack(f.read(FRAME.size))[0]
+        if n + 2 * FRAME.size > size:
+            return 0, 0, ValueError(f"bad frame at end of {path}")
+        f.seek(size - n - 2 * FRAME.size)
+        if FRAME.unpack(f.read(FRAME.size))[0] != n:
+            return 0, 0, ValueError(f"bad frame at end of {path}")
+        try:
+            df = pl.read_ipc_stream(io.BytesIO(f.read(n)))
+        except pl.exceptions.PolarsError as err:
+            return 0, 0, err
+        if df.height == 0:
+            return 0, 0, ValueError(f"empty frame at end of {path}")
+        return df.item(-1, "dt").timestamp(), df.item(-1, "id"), None
+
+
+def parse_backfill(args: Sequence[str]) -> tuple[int, list[str], str | None]:
+    segments, rest = 0, []
+    it = iter(args)
+    for arg in it:
+        if arg == "--backfill":
+            arg = "--backfill=" + next(it, "")
+        if arg.startswith("--backfill="):
+            try:
+                segments = int(arg.removeprefix("--backfill="))
+            except ValueError:
+                return 0, [], f"bad number of segments: {arg}"
+            if segments < 1:
+                return 0, [], f"bad number of segments: {segments}"
+            continue
+        rest.append(arg)
+    return segments, rest, None
+
+
+@dataclass
+class Checkpoint:
+    offset: int
+    size: int
+    last_id: int
+    month: int
+    intervals: list[str] | None = None
+    scale: int | None = None
+    format: str | None = None
+    months: list[int] | None = None
+
+
+class Limiter:
+    def __init__(self, burst: int = 22, rate: float = 1, max_delay: float = 5) -> None:
+        self._burst, self._rate, self._max_delay = burst, rate, max_delay
+        self._tokens, self._t = float(burst), time.monotonic()
+        self._until, self._delay = 0.0, 0.0
+        self._lock = threading.Lock()
+        self.requests, self.backoffs = 0, 0
+        self.throttled, self.backed_off = 0.0, 0.0
+
+    def acquire(self) -> None:
+        while True:
+            with self._lock:
+                now = time.monotonic()
+                self._tokens = min(self._burst, self._tokens + (now - self._t) * self._rate)
+                self._t = now
+                if now >= self._until and self._tokens >= 1:
+                    self._tokens -= 1
+                    self.requests += 1
+                    return
+                backoff = max(0.0, self._until - now)
+                wait = max(backoff, (1 - self._tokens) / self._rate)
+                self.backed_off += backoff
+                self.throttled += wait - backoff
+            time.sleep(wait)
+
+    def backoff(self) -> None:
+        with self._lock:
+            self.backoffs += 1
+            self._delay = min(max(1, self._delay * 2), self._max_delay)
+            self._until = max(self._until, time.monotonic() + self._delay)
+            self._tokens = 0
+
+    def ok(self) -> None:
+        with self._lock:
+            self._delay = 0
+
+
+class PageCache:
+    def __init__(self, path: str | os.PathLike[str], max_size: int = 1 << 30) -> None:
+        self._path, self._max_size = Path(path), max_size
+        self._lock = threading.Lock()
+        self.hits, self.size = 0, 0
+        for f in self._path.glob("*/*.json.gz"):
+            self.size += f.stat().st_size
+
+    def _file(self, pair: str, since: str) -> Path:
+        key = hashlib.sha256(f"{pair}\0{since}".encode()).hexdigest()
+        return self._path / key[:2] / f"{key}.json.gz"
+
+    def has(self, pair: str, since: str) -> bool:
+        return self._file(pair, since).exists()
+
+    def get(self, pair: str, since: str) -> bytes | None:
+        path = self._file(pair, since)
+        try:
+            with open(path, "rb") as f:
+                content = gzip.decompress(f.read())
+            os.utime(path)
+        except (OSError, EOFError):
+            return None
+        return content
+
+    def hit(self) -> None:
+        with self._lock:
+            self.hits += 1
+
+    def put(self, pair: str, since: str, content: bytes) -> None:
+        path = self._file(pair, since)
+        data = gzip.compress(content, mtime=0)
+        try:
+            path.parent.mkdir(parents=True, exist_ok=True)
+            tmp = path.with_name(f"{path.name}.{threading.get_ident()}.tmp")
+            tmp.write_bytes(data)
+            os.replace(tmp, path)
+        except OSError:
+            return
+        with self._lock:
+            self.size += len(data)
+            if self.size > self._max_size:
+                self._evict()
+
+    def _starts_file(self, pair: str) -> Path:
+        return self._path / "starts" / f"{hashlib.sha256(pair.encode()).hexdigest()}.json"
+
+    def starts(self, pair: str) -> list[str]:
+        try:
+            with open(self._starts_file(pair), "r") as f:
+                starts = json.load(f)
+        except (OSError, ValueError):
+            return []
+        return [s for s in starts if isinstance(s, str)] if isinstance(starts, list) else []
+
+    def add_start(self, pair: str, since: str) -> None:
+        with self._lock:
+            starts = self.starts(pair)
+            if since in starts:
+                return
+            path = self._starts_file(pair)
+            try:
+                path.parent.mkdir(parents=True, exist_ok=True)
+                tmp = path.with_name(f"{path.name}.{threading.get_ident()}.tmp")
+                tmp.write_text(json.dumps(sorted(starts + [since], key=cursor_time)))
+                os.replace(tmp, path)
+            except OSError:
+                pass
+
+    def next_start(self, pair: str, after: str, until: str) -> str | None:
+        lo, hi = cursor_time(after), cursor_time(until)
+        starts = [s for s in self.starts(pair) if lo < cursor_time(s) <= hi]
+        return max(starts, key=cursor_time) if starts else None
+
+    def _evict(self) -> None:
+        files = []
+        for f in self._path.glob("*/*.json.gz"):
+            try:
+                st = f.stat()
+            except OSError:
+                continue
+            files.append((st.st_mtime, st.st_size, f))
+        files.sort()
+        self.size = sum(size for _, size, _ in files)
+        for _, size, f in files:
+            if self.size <= self._max_size * 0.9:
+                break
+            f.unlink(missing_ok=True)
+            self.size -= size
+
+
+def cursor_time(since: str) -> float:
+    try:
+        t = float(since)
+    except ValueError:
+        return 0.0
+    return t / 1e9 if t > 1e12 else t
+
+
+def parse_cache(args: Sequence[str]) -> tuple[PageCache | None, bool, list[str], str | None]:
+    path, max_size, replay, rest = None, 1 << 30, False, []
+    it = iter(args)
+    for arg in it:
+        if arg in ("--cache", "--cache-size"):
+            arg = arg + "=" + next(it, "")
+        if arg.startswith("--cache="):
+            path = arg.removeprefix("--cache=")
+            if not path:
+                return None, False, [], "cache path?"
+            continue
+        if arg.startswith("--cache-size="):
+            try:
+                max_size = int(arg.removeprefix("--cache-size=")) << 20
+            except ValueError:
+                return None, False, [], f"bad cache size: {arg}"
+            if max_size <= 0:
+                return None, False, [], f"bad cache size: {max_size >> 20}"
+            continue
+        if arg == "--replay":
+            replay = True
+            continue
+        rest.append(arg)
+    if path is None:
+        return None, False, rest, "--replay needs --cache" if replay else None
+    return PageCache(path, max_size), replay, rest, None
 
 
 class Client:
 
     BASE_URL = "https://api.kraken.com/0/public/Trades"
+    RATE_LIMITED = ("EAPI:Rate limit exceeded", "EGeneral:Too many requests")
 
-    def __init__(self) -> None:
+    def __init__(
+        self, limiter: Limiter | None = None, cache: PageCache | None = None, replay: bool = False
+    ) -> None:
         self._s = requests.Session()
         self._s.headers.update({"User-Agent": "prep/1.0"})
-        self._delay, self._n = 0, 0
-
-    def _sleep(self, err: Any | None = None):
-        time.sleep(self._delay)
-        if err is None:
-            self._delay, self._n = 0 if self._n < 22 else 1, self._n + 1
-        else:
-            self._delay, self._n = min(max(1, self._delay * 2), 5), 0
+        self._limiter = limiter if limiter is not None else Limiter()
+        self._cache, self._replay = cache, replay
 
     def _get_trades_page(
         self,
@@ -302,106 +889,146 @@ class Client:
         timeout: float = 10,
         max_retries: int = 5,
     ) -> tuple[dict[str, Any], Exception | None]:
+        if self._cache is not None:
+            page = self._cached_page(pair, since)
+            if page is not None:
+                return page, None
+            if self._replay:
+                return {"error": [], "result": {pair: [], "last": since}}, None
+
         last_err: Exception | None = None
 
         for _ in range(max_retries):
-            self._sleep()
+            self._limiter.acquire()
             try:
                 resp = self._s.get(self.BASE_URL, params={"pair": pair, "since": since}, timeout=timeout)
             except requests.RequestException as err:
-                self._sleep(err)
+                self._limiter.backoff()
                 last_err = err
                 continue
+            if resp.status_code == 429:
+                self._limiter.backoff()
+                last_err = RuntimeError("Kraken error: HTTP 429")
+                continue
             try:
-                page = resp.json()
+                page = loads(resp.content)
             except ValueError as err:
-                self._sleep(err)
+                self._limiter.backoff()
                 last_err = err
                 continue
             api_err = page.get("error")
+            if api_err and any(e in self.RATE_LIMITED for e in api_err):
+                self._limiter.backoff()
+                last_err = RuntimeError(f"Kraken error: {api_err}")
+                continue
             if api_err:
                 return {}, RuntimeError(f"Kraken error: {api_err}")
+            self._limiter.ok()
+            if self._cache is not None:
+                self._cache.put(pair, since, resp.content)
             return page, None
 
         return {}, last_err
 
+    def _cached_page(self, pair: str, since: str) -> dict[str, Any] | None:
+        assert self._cache is not None
+        content = self._cache.get(pair, since)
+        if content is None:
+            return None
+        try:
+            page = loads(content)
+        except ValueError:
+            return None
+        result = page.get("result")
+        last = result.get("last") if isinstance(result, dict) else None
+        if not self._replay and (
+            not isinstance(last, str) or last == since or not self._cache.has(pair, last)
+        ):
+            return None
+        self._cache.hit()
+        return page
+
     def _fetch_trades(
         self,
         pair: str,
         start: float,
         last_id: int = 0,
-    ) -> Generator[tuple[list[TradeRecord], Exception | None], None, None]:
-        since, end = str(start), time.time()
+        until: float | None = None,
+    ) -> Generator[tuple[pl.DataFrame, Exception | None], None, None]:
+        since, end = str(start), time.time() if until is None else until
+        chain = since
+        if self._cache is not None and not self._replay:
+            self._cache.add_start(pair, since)
 
         while True:
             page, err = self._get_trades_page(pair, since)
             if err is not None:
-                yield [], err
+                yield EMPTY, err
                 return
 
             sym, trades, last, err = self._parse_page(page)
             if err is not None:
-                yield [], err
+                yield EMPTY, err
                 return
 
-            if not trades:
+            trades = trades.filter(pl.col("id") > last_id)
+            if trades.height == 0:
+                if self._replay and self._cache is not None:
+                    resume = self._cache.next_start(pair, chain, last)
+                    if resume is not None:
+                        chain = since = resume
+                        continue
                 return
 
-            i, n = 0, len(trades)
-            while i < n and trades[i][6] <= last_id:
-                i += 1
-            if i > 0:
-                trades = trades[i:]
-
-            if not trades:
+            if until is not None and trades.item(-1, "dt").timestamp() >= until:
+                trades = trades.filter(pl.col("dt") < datetime.fromtimestamp(until, tz=timezone.utc))
+                if trades.height > 0:
+                    yield trades, None
                 return
 
-            since, last_ts, last_id = last, trades[-1][0], trades[-1][6]
+            since, last_ts, last_id = last, trades.item(-1, "dt").timestamp(), trades.item(-1, "id")
 
             yield trades, None
 
             if end < last_ts:
                 return
 
-    def _parse_page(self, page: dict[str, Any]) -> tuple[str, list[TradeRecord], str, Exception | None]:
+    def _parse_page(self, page: dict[str, Any]) -> tuple[str, pl.DataFrame, str, Exception | None]:
         result = page.get("result")
         if not isinstance(result, dict):
-            return "", [], "", RuntimeError("no result?")
+            return "", EMPTY, "", RuntimeError("no result?")
 
         keys, last = [k for k in result.keys() if k != "last"], result.get("last")
         if not keys or not isinstance(last, str):
-            return "", [], "", RuntimeError("missing something?")
+            return "", EMPTY, "", RuntimeError("missing something?")
 
         sym = keys[0]
         rows = result.get(sym)
         if not isinstance(rows, list):
-            return "", [], "", RuntimeError("no trades?")
+            return "", EMPTY, "", RuntimeError("no trades?")
+        if not rows:
+            return sym, EMPTY, last, None
 
-        trades: list[TradeRecord] = []
-        for row in rows:
-            if (
-                not isinstance(row, list)
-                or len(row) < 7
-                or not isinstance(row[0], str)  # price
-                or not isinstance(row[1], str)  # volume
-                or not isinstance(row[2], (int, float))  # timestamp
-                or not isinstance(row[6], int)  # trade id
-            ):
-                return "", [], "", RuntimeError(f"unexpected {row}")
-
-            trades.append(
-                (
-                    row[2],
-                    row[0],
-                    row[1] if row[3] == "b" else "0",
-                    row[1] if row[3] == "s" else "0",
-                    row[1] if row[4] == "m" else "0",
-                    row[1] if row[4] == "l" else "0",
-                    row[6],
-                )
-            )
+        try:
+            if min(map(len, rows)) < 7:
+                raise TypeError("short row")
+            cols = list(zip(*rows))
+            df = pl.DataFrame([pl.Series(name, cols[i], dtype, strict=True) for name, i, dtype in COLUMNS])
+        except TypeError as err:
+            return "", EMPTY, "", RuntimeError(f"unexpected trades: {err}")
 
-        return sym, trades, last, None
+        if any(s.null_count() for s in df.get_columns()) or not (
+            set(cols[3]) <= {"b", "s"} and set(cols[4]) <= {"m", "l"}
+        ):
+            row = next(
+                row
+                for row in rows
+                if None in (row[0], row[1], row[2], row[6])
+                or row[3] not in ("b", "s")
+                or row[4] not in ("m", "l")
+            )
+            return "", EMPTY, "", RuntimeError(f"unexpected {row}")
+        return sym, df.select(TRADES), last, None
 
 
 def get_cmd(name: str) -> tuple[Cmd | None, str | None]:
@@ -410,5 +1037,7 @@ def get_cmd(name: str) -> tuple[Cmd | None, str | None]:
             return Fetch(), None
         case "import":
             return Import(), None
+        case "sync":
+            return Sync(), None
         case _:
             return None, f"command {name} not found in module {__name__}"
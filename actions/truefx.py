@@ -1,65 +1,108 @@
-import os
-from pathlib import Path
+from typing import TYPE_CHECKING, Any, Iterator
 
-import numpy as np
 import polars as pl
 
-from common import Cmd, Symbol, p
-from fs import Block, Store
+import ingest
+from common import Cmd, Symbol, lazy
+from fs import Block, Store, fingerprint
 
+if TYPE_CHECKING:
+    import numpy as np
+else:
+    np = lazy("numpy")
+
+OPTIONS: dict[str, Any] = dict(
+    infer_schema=False,
+    columns=[1, 2, 3],
+    new_columns=["ts", "bid", "ask"],
+)
 
-class Import(Cmd):
-    def run(self, *args, **kwargs) -> tuple[int | None, str | Exception | None]:
-        symbols: dict[str, Symbol] | None = kwargs.get("symbols")
-        if not symbols:
-            return None, None
-        path: str | os.PathLike[str] | None = kwargs.get("path")
-        path = path if path is not None else ""
-        store = Store(path)
-        for arg in args:
-            sym = self._parse_arg(arg)
-            if sym.lower() not in symbols:
-                p(f"Skipping {arg}")
-                continue
-            p(f"Processing {arg}... ", end="")
-            err = self._process_arg(arg, symbols[sym.lower()], store)
-            if err is not None:
-                p()
-                return 2, err
-            p("done.")
-        return None, None
 
+class Import(ingest.Import):
     @staticmethod
-    def _parse_arg(arg: str) -> str:
-        sym, _, _ = Path(arg).stem.partition("-")
-        return sym
+    def _parse_arg(arg: str) -> tuple[str, Exception | None]:
+        sym, _, _ = ingest.stem(arg).partition("-")
+        return sym, None
 
     @staticmethod
-    def _process_arg(arg: str, symbol: Symbol, store: Store) -> str | Exception | None:
+    def _process_arg(arg: str, symbol: Symbol, store: Store) -> Exception | None:
+        scale = symbol.scale if symbol.scale is not None else ingest.SCALE
+        intervals: list[str | None] = list(symbol.intervals) if symbol.intervals is not None else [None]
+        every = intervals[0] or "23s"
         try:
-            df = pl.read_csv(
-                arg,
-                has_header=False,
-                infer_schema=False,
-                columns=(1, 2, 3),
-                new_columns=("ts", "bid", "ask"),
-            )
+            with ingest.open_source(arg) as f:
+                batches = (batch for _, _, batch in ingest.read_batches(f, **OPTIONS))
+                df, err = Import._bars(batches, arg, symbol, every, scale)
+            if err is None and df is None:
+                with ingest.open_source(arg) as f:
+                    df = pl.read_csv(f, has_header=False, **OPTIONS)
+                df, err = Import._bars(iter([df]), arg, symbol, every, scale, True)
         except OSError as e:
             return e
-        df = (
-            df.with_columns(
-                pl.col("ts")
-                .str.to_datetime(format="%Y%m%d %H:%M:%S%.3f", time_zone=symbol.time)
-                .alias("dt")
-            )
-            .sort("dt")
-            .with_columns(pl.Series(np.random.default_rng(1).integers(0, 2, df.height)).alias("hit"))
-            .with_columns(
-                pl.when(pl.col("hit") == 0).then(pl.col("bid")).otherwise(pl.col("ask")).alias("price")
+        if err is not None:
+            return err
+        if df is None or df.height == 0:
+            return None
+        start, source = df.item(1, "dt"), fingerprint(arg)
+        for interval in intervals:
+            bars = (
+                df if interval is None or interval == intervals[0] else ingest.rollup(df, interval, scale)
             )
-            .with_columns(pl.col("price").cast(pl.Float32).alias("price_value"))
-        )
-        df = df.group_by_dynamic(index_column="dt", every="23s", closed="left").agg(
+            err = store.put(Block(symbol.name, symbol.market, start, bars, source, interval))
+            if err is not None:
+                return err
+        return None
+
+    @staticmethod
+    def _bars(
+        batches: Iterator[pl.DataFrame],
+        arg: str,
+        symbol: Symbol,
+        every: str,
+        scale: int,
+        sort: bool = False,
+    ) -> tuple[pl.DataFrame | None, Exception | None]:
+        chunks: list[pl.DataFrame] = []
+        bars = ingest.Bars(every, lambda df: Import._aggregate(df, every), chunks.append)
+        rng = np.random.default_rng(1)
+        last = None
+        try:
+            for batch in batches:
+                if batch.select(ingest.check_fixed(["bid", "ask"], scale)).item():
+                    return None, ValueError(f"more than {scale} decimals in {arg}")
+                batch = batch.with_columns(
+                    pl.col("ts")
+                    .str.to_datetime(format="%Y%m%d %H:%M:%S%.3f", time_zone=symbol.time)
+                    .alias("dt")
+                )
+                if sort:
+                    batch = batch.sort("dt")
+                elif not batch["dt"].is_sorted() or (last is not None and batch.item(0, "dt") < last):
+                    return None, None
+                last = batch.item(-1, "dt")
+                batch = (
+                    batch.with_columns(pl.Series("hit", rng.integers(0, 2, batch.height)))
+                    .with_columns(
+                        pl.when(pl.col("hit") == 0)
+                        .then(pl.col("bid"))
+                        .otherwise(pl.col("ask"))
+                        .alias("price")
+                    )
+                    .with_columns(ingest.parse_fixed("price", scale).alias("price_value"))
+                )
+                err = bars.push(batch)
+                if err is not None:
+                    return None, err
+        except pl.exceptions.PolarsError as e:
+            return None, e
+        err = bars.close()
+        if err is not None:
+            return None, err
+        return pl.concat(chunks) if chunks else pl.DataFrame(), None
+
+    @staticmethod
+    def _aggregate(df: pl.DataFrame, every: str) -> pl.DataFrame:
+        return df.group_by_dynamic(index_column="dt", every=every, closed="left").agg(
             pl.col("price").first().alias("open"),
             pl.col("price")
             .filter(pl.col("price_value") == pl.col("price_value").max())
@@ -71,15 +114,13 @@ class Import(Cmd):
             .alias("low"),
             pl.col("price").last().alias("close"),
         )
-        err = store.put(Block(symbol.name, symbol.market, df.item(1, "dt"), df))
-        if err is not None:
-            return err
-        return None
 
 
 def get_cmd(name: str) -> tuple[Cmd | None, str | None]:
     match name:
         case "import":
             return Import(), None
+        case "watch":
+            return ingest.Watch(Import()), None
         case _:
             return None, f"command {name} not found in module {__name__}"
@@ -0,0 +1,76 @@
+import argparse
+import importlib
+import sys
+import tempfile
+import threading
+import time
+from datetime import datetime, timezone
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+import kraken_server  # noqa: E402
+
+from common import Action, Symbol  # noqa: E402
+
+kraken = importlib.import_module("actions.kraken")
+
+
+def main(argv: list[str]) -> tuple[int | None, str | Exception | None]:
+    parser = argparse.ArgumentParser(description="Benchmark Kraken fetch against a local stand-in server")
+    parser.add_argument("--pairs", type=int, default=4)
+    parser.add_argument("--jobs", type=int, help="default: fetch's own")
+    parser.add_argument("--backfill", type=int, default=0, help="segments per pair")
+    parser.add_argument("--log", choices=list(kraken.LOGS), default="csv")
+    parser.add_argument("--burst", type=int, default=22, help="client limiter burst")
+    parser.add_argument("--rate", type=float, default=1.0, help="client limiter requests per second")
+    kraken_server.add_arguments(parser)
+    args = parser.parse_args(argv[1:])
+
+    server = kraken_server.Server(("127.0.0.1", 0), kraken_server.config(args))
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    kraken.Client.BASE_URL = server.url
+
+    start = datetime.fromtimestamp(kraken_server.T0, tz=timezone.utc)
+    symbols = {f"x{i}usd": Symbol(f"X{i}USD", "Kraken", start=start) for i in range(args.pairs)}
+    limiter = kraken.Limiter(args.burst, args.rate)
+    fetch_args = [f"--jobs={args.jobs}"] if args.jobs is not None else []
+    fetch_args += [f"--backfill={args.backfill}"] if args.backfill > 1 else []
+
+    with tempfile.TemporaryDirectory() as dl:
+        started = time.monotonic()
+        code, err = kraken.Fetch(limiter).run(
+            *fetch_args, dl, symbols=symbols, action=Action("fetch", using="kraken", log=args.log)
+        )
+        elapsed = time.monotonic() - started
+        if err is not None:
+            return code, err
+        size, trades = 0, 0
+        for path in Path(dl).iterdir():
+            size += path.stat().st_size
+            with open(path, "rb") as f:
+                if kraken.is_ipc(path):
+                    trades += sum(df.height for _, _, df in kraken.read_frames(f))
+                else:
+                    trades += sum(1 for _ in f)
+
+    stats = server.stats
+    server.shutdown()
+    print(f"pairs {args.pairs}, jobs {args.jobs}, {elapsed:.2f}s")
+    print(f"pages      {stats.pages:8d}  {stats.pages / elapsed:10.1f}/s")
+    print(f"trades     {trades:8d}  {trades / elapsed:10.1f}/s")
+    print(f"requests   {stats.requests:8d}  limited {stats.limited}, malformed {stats.malformed}")
+    print(f"throttled  {limiter.throttled:8.2f}s")
+    print(f"backoff    {limiter.backed_off:8.2f}s  in {limiter.backoffs} backoffs")
+    print(f"log        {size:8d} bytes")
+    if trades != args.pairs * args.trades:
+        return 2, f"expected {args.pairs * args.trades} trades, logged {trades}"
+    return None, None
+
+
+if __name__ == "__main__":
+    ret, err = main(sys.argv)
+    if err is not None:
+        print("Error:", err, file=sys.stderr)
+    if ret is not None:
+        sys.exit(ret)
@@ -0,0 +1,165 @@
+import argparse
+import json
+import math
+import random
+import sys
+import threading
+import time
+from dataclasses import dataclass, field
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlparse
+
+PATH = "/0/public/Trades"
+T0 = 1609459200  # 2021-01-01T00:00:00Z
+
+
+@dataclass
+class Config:
+    trades: int = 100_000
+    page: int = 1000
+    step: float = 0.37
+    latency: float = 0.0
+    burst: int = 0
+    rate: float = 1.0
+    malformed: float = 0.0
+    seed: int = 1
+
+
+@dataclass
+class Stats:
+    requests: int = 0
+    pages: int = 0
+    trades: int = 0
+    limited: int = 0
+    malformed: int = 0
+    lock: threading.Lock = field(default_factory=threading.Lock, repr=False)
+
+
+class Server(ThreadingHTTPServer):
+    daemon_threads = True
+
+    def __init__(self, address: tuple[str, int], config: Config) -> None:
+        super().__init__(address, Handler)
+        self.config, self.stats = config, Stats()
+        self._rng = random.Random(config.seed)
+        self._tokens, self._t = float(config.burst), time.monotonic()
+
+    @property
+    def url(self) -> str:
+        host, port = self.server_address[:2]
+        return f"http://{host!s}:{port}{PATH}"
+
+    def admit(self) -> tuple[bool, bool]:
+        with self.stats.lock:
+            self.stats.requests += 1
+            if self.config.burst > 0:
+                now = time.monotonic()
+                self._tokens = min(self.config.burst, self._tokens + (now - self._t) * self.config.rate)
+                self._t = now
+                if self._tokens < 1:
+                    self.stats.limited += 1
+                    return False, False
+                self._tokens -= 1
+            if self._rng.random() < self.config.malformed:
+                self.stats.malformed += 1
+                return True, True
+            return True, False
+
+    def page(self, pair: str, since: str) -> dict[str, object]:
+        c = self.config
+        try:
+            t = float(since)
+        except ValueError:
+            t = 0
+        if t > 1e12:
+            t /= 1e9
+        j = max(0, math.ceil((t - T0) / c.step - 0.5))
+        while j < c.trades and trade_time(j, c.step) < t:
+            j += 1
+        rows = [trade(i, c.step) for i in range(j, min(j + c.page, c.trades))]
+        last = str(int(trade_time(j + len(rows) - 1, c.step) * 1e9)) if rows else since
+        with self.stats.lock:
+            self.stats.pages += 1
+            self.stats.trades += len(rows)
+        return {"error": [], "result": {pair: rows, "last": last}}
+
+
+class Handler(BaseHTTPRequestHandler):
+    server: Server
+
+    def log_message(self, format: str, *args: object) -> None:
+        pass
+
+    def do_GET(self) -> None:
+        url = urlparse(self.path)
+        if url.path != PATH:
+            self.send_error(404)
+            return
+        query = parse_qs(url.query)
+        pair, since = query.get("pair", [""])[0], query.get("since", ["0"])[0]
+        if self.server.config.latency > 0:
+            time.sleep(self.server.config.latency)
+        admitted, malformed = self.server.admit()
+        if not admitted:
+            body = json.dumps({"error": ["EGeneral:Too many requests"]}).encode()
+        elif not pair:
+            body = json.dumps({"error": ["EQuery:Unknown asset pair"]}).encode()
+        else:
+            body = json.dumps(self.server.page(pair, since)).encode()
+            if malformed:
+                body = body[: len(body) // 2]
+        self.send_response(200)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+
+def trade_time(j: int, step: float) -> float:
+    return round(T0 + (j + (j * 2654435761 % 1000) / 2000) * step, 4)
+
+
+def trade(j: int, step: float) -> list[object]:
+    price = 30000 + 500 * math.sin(j / 5000) + (j * 7919 % 100) / 10
+    volume = (j * 104729 % 1000000) / 1e7 + 1e-8
+    side, kind = "bs"[j * 31 % 7 % 2], "ml"[j * 17 % 5 % 2]
+    return [f"{price:.5f}", f"{volume:.8f}", trade_time(j, step), side, kind, "", j + 1]
+
+
+def add_arguments(parser: argparse.ArgumentParser) -> None:
+    parser.add_argument("--trades", type=int, default=Config.trades, help="trades per pair")
+    parser.add_argument("--page", type=int, default=Config.page, help="trades per page")
+    parser.add_argument("--latency", type=float, default=Config.latency, help="seconds per request")
+    parser.add_argument("--server-burst", type=int, default=Config.burst, help="0 disables rate limiting")
+    parser.add_argument("--server-rate", type=float, default=Config.rate, help="requests per second")
+    parser.add_argument(
+        "--malformed", type=float, default=Config.malformed, help="share of truncated pages"
+    )
+
+
+def config(args: argparse.Namespace) -> Config:
+    return Config(
+        trades=args.trades,
+        page=args.page,
+        latency=args.latency,
+        burst=args.server_burst,
+        rate=args.server_rate,
+        malformed=args.malformed,
+    )
+
+
+def main(argv: list[str]) -> None:
+    parser = argparse.ArgumentParser(description="Local stand-in for the Kraken public Trades endpoint")
+    parser.add_argument("--port", type=int, default=8765)
+    add_arguments(parser)
+    args = parser.parse_args(argv[1:])
+    server = Server(("127.0.0.1", args.port), config(args))
+    print(f"Serving {server.url}", file=sys.stderr)
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == "__main__":
+    main(sys.argv)
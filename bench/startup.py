@@ -0,0 +1,85 @@
+import argparse
+import subprocess
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+PREP = Path(__file__).resolve().parent.parent / "prep.py"
+HEAVY = ("yaml", "polars", "numpy", "requests")
+
+PREPFILE = """\
+symbols:
+  - market: Kraken
+    start: 2021-01-01
+    symbols:
+      - name: XBTUSD
+      - name: ETHUSD
+actions:
+  - using: kraken
+    intervals: [1m, 1h]
+    actions:
+      - name: fetch
+      - name: import
+"""
+
+TRACE = f"""\
+import runpy, sys
+sys.argv = sys.argv[1:]
+sys.path.insert(0, {str(PREP.parent)!r})
+try:
+    runpy.run_path(sys.argv[0], run_name="__main__")
+except SystemExit:
+    pass
+print(*(m for m in {HEAVY!r} if m in sys.modules and type(sys.modules[m]).__name__ != "_LazyModule"))
+"""
+
+
+def run(argv: list[str], n: int, cold: Path | None = None) -> tuple[float, float, list[str]]:
+    times = []
+    for _ in range(n):
+        if cold is not None:
+            cold.unlink(missing_ok=True)
+        started = time.perf_counter()
+        subprocess.run([sys.executable, str(PREP), *argv], capture_output=True)
+        times.append(time.perf_counter() - started)
+    if cold is not None:
+        cold.unlink(missing_ok=True)
+    trace = subprocess.run([sys.executable, "-c", TRACE, str(PREP), *argv], capture_output=True, text=True)
+    loaded = trace.stdout.split()
+    return sum(times) / n, min(times), loaded
+
+
+def main(argv: list[str]) -> tuple[int | None, str | Exception | None]:
+    parser = argparse.ArgumentParser(description="Measure prep.py startup time")
+    parser.add_argument("-n", type=int, default=20, help="runs per scenario")
+    args = parser.parse_args(argv[1:])
+
+    with tempfile.TemporaryDirectory() as tmp:
+        good, bad = Path(tmp, "good"), Path(tmp, "bad")
+        good.mkdir()
+        bad.mkdir()
+        Path(good, ".prep").write_text(PREPFILE)
+        Path(bad, ".prep").write_text(PREPFILE.replace("intervals", "interval"))
+        cache = Path(good, ".prep.cache")
+
+        scenarios = [
+            ("usage", [], None),
+            ("list, parse", [str(good)], cache),
+            ("list, cached", [str(good)], None),
+            ("config error", [str(bad)], None),
+            ("import", [str(good), "import"], None),
+        ]
+        print(f"{'':14s} {'mean':>8s} {'min':>8s}  imports")
+        for name, prep_args, cold in scenarios:
+            mean, best, loaded = run(prep_args, args.n, cold)
+            print(f"{name:14s} {mean * 1000:6.1f}ms {best * 1000:6.1f}ms  {' '.join(loaded) or '-'}")
+    return None, None
+
+
+if __name__ == "__main__":
+    ret, err = main(sys.argv)
+    if err is not None:
+        print("Error:", err, file=sys.stderr)
+    if ret is not None:
+        sys.exit(ret)
@@ -1,8 +1,11 @@
+import importlib.util
+import os
 import sys
-from collections.abc import Callable
-from dataclasses import dataclass
+from collections.abc import Callable, Sequence
+from dataclasses import dataclass, field
 from datetime import datetime, timezone
 from functools import lru_cache
+from types import ModuleType
 from typing import Protocol
 from zoneinfo import ZoneInfo, ZoneInfoNotFoundError
 
@@ -13,6 +16,24 @@ class Symbol:
     market: str | None = None
     time: str | None = None
     start: datetime | None = None
+    intervals: list[str] | None = None
+    scale: int | None = None
+
+
+@dataclass
+class Step:
+    name: str
+    run: str
+    path: str | None = None
+    args: list[str] = field(default_factory=list)
+    after: list[str] = field(default_factory=list)
+
+
+@dataclass
+class Pipeline:
+    name: str
+    steps: list[Step] = field(default_factory=list)
+    jobs: int | None = None
 
 
 class Cmd(Protocol):
@@ -23,6 +44,11 @@ class Cmd(Protocol):
 class Action(Cmd):
     name: str
     using: str | None = None
+    format: str | None = None
+    writers: int | None = None
+    merge: bool | None = None
+    intervals: list[str] | None = None
+    log: str | None = None
     fn: Callable[..., tuple[int | None, str | Exception | None]] | None = None
 
     def run(self, *args, **kwargs) -> tuple[int | None, str | Exception | None]:
@@ -45,6 +71,11 @@ def ts(dt: datetime) -> str:
     return dt.isoformat("T", "seconds")
 
 
+def seconds(interval: str) -> int:
+    n, unit = int(interval[:-1]), interval[-1]
+    return n * {"s": 1, "m": 60, "h": 3600, "d": 86400}[unit]
+
+
 def zx(s: str) -> str:
     if "." in s:
         s = s.rstrip("0").rstrip(".")
@@ -54,6 +85,40 @@ def zx(s: str) -> str:
     return s
 
 
+def parse_jobs(args: Sequence[str], default: int = 1) -> tuple[int, list[str], str | None]:
+    jobs, rest = default, []
+    it = iter(args)
+    for arg in it:
+        if arg == "--jobs":
+            arg = "--jobs=" + next(it, "")
+        if arg.startswith("--jobs="):
+            try:
+                jobs = int(arg.removeprefix("--jobs="))
+            except ValueError:
+                return 0, [], f"bad number of jobs: {arg}"
+            if jobs < 0:
+                return 0, [], f"bad number of jobs: {jobs}"
+            if jobs == 0:
+                jobs = os.cpu_count() or 1
+            continue
+        rest.append(arg)
+    return jobs, rest, None
+
+
+def lazy(name: str) -> ModuleType:
+    if name in sys.modules:
+        return sys.modules[name]
+    spec = importlib.util.find_spec(name)
+    if spec is None or spec.loader is None:
+        raise ModuleNotFoundError(f"No module named {name!r}", name=name)
+    loader = importlib.util.LazyLoader(spec.loader)
+    spec.loader = loader
+    module = importlib.util.module_from_spec(spec)
+    sys.modules[name] = module
+    loader.exec_module(module)
+    return module
+
+
 def p(*what, **mods) -> None:
     print(*what, **mods, file=sys.stderr, flush=True)
 
@@ -1,16 +1,26 @@
 from __future__ import annotations
 
 import datetime
+import json
 import os
+import re
 from collections.abc import Iterable, Iterator, Mapping
-from dataclasses import replace
+from dataclasses import asdict, replace
+from typing import TYPE_CHECKING, Any
+from zoneinfo import ZoneInfo
 
-import yaml
+from common import Action, Pipeline, Step, Symbol, lazy, seconds, tz
 
-from common import Action, Symbol, tz
+if TYPE_CHECKING:
+    import yaml
+else:
+    yaml = lazy("yaml")
+
+CACHE_VERSION = 2
 
 _symbols: dict[str, Symbol] = {}
 _actions: dict[str, Action] = {}
+_pipelines: dict[str, Pipeline] = {}
 
 
 def symbols() -> dict[str, Symbol]:
@@ -21,12 +31,29 @@ def actions() -> dict[str, Action]:
     return _actions
 
 
+def pipelines() -> dict[str, Pipeline]:
+    return _pipelines
+
+
 class Error(Exception):
     def __init__(self, message: str):
         super().__init__("config: " + message)
 
 
 def load(filename: str | os.PathLike[str]) -> Exception | None:
+    global _symbols, _actions, _pipelines
+
+    try:
+        st = os.stat(filename)
+    except OSError as err:
+        return err
+    key = (CACHE_VERSION, st.st_mtime_ns, st.st_size)
+    cachefile = os.fspath(filename) + ".cache"
+    cached = _read_cache(cachefile, key)
+    if cached is not None:
+        _symbols, _actions, _pipelines = cached
+        return None
+
     try:
         with open(filename, "r") as f:
             co = yaml.safe_load(f)
@@ -39,6 +66,7 @@ def load(filename: str | os.PathLike[str]) -> Exception | None:
 
     symbols: dict[str, Symbol] = {}
     actions: dict[str, Action] = {}
+    pipelines: dict[str, Pipeline] = {}
 
     try:
         for symbol in _walk_symbols(co.get("symbols")):
@@ -49,14 +77,84 @@ def load(filename: str | os.PathLike[str]) -> Exception | None:
             if action.name in actions:
                 raise Error(f"duplicate action: {action.name}")
             actions[action.name] = action
+        for pipeline in _walk_pipelines(co.get("pipelines")):
+            if pipeline.name in actions or pipeline.name in pipelines:
+                raise Error(f"duplicate action: {pipeline.name}")
+            for step in pipeline.steps:
+                if step.path is None and step.run not in actions:
+                    raise Error(f"unknown action in pipeline {pipeline.name}: {step.run}")
+            pipelines[pipeline.name] = pipeline
     except Error as err:
         return err
 
-    global _symbols, _actions
-    _symbols, _actions = symbols, actions
+    _symbols, _actions, _pipelines = symbols, actions, pipelines
+    _write_cache(cachefile, key, (symbols, actions, pipelines))
     return None
 
 
+def _read_cache(
+    filename: str, key: tuple[int, int, int]
+) -> tuple[dict[str, Symbol], dict[str, Action], dict[str, Pipeline]] | None:
+    try:
+        with open(filename, "r") as f:
+            cached = json.load(f)
+        if cached.get("key") != list(key):
+            return None
+        symbols = {k: _load_symbol(v) for k, v in cached["symbols"].items()}
+        actions = {k: Action(**v) for k, v in cached["actions"].items()}
+        pipelines = {
+            k: Pipeline(v["name"], [Step(**step) for step in v["steps"]], v["jobs"])
+            for k, v in cached["pipelines"].items()
+        }
+    except (OSError, ValueError, TypeError, KeyError, AttributeError):
+        return None
+    return symbols, actions, pipelines
+
+
+def _write_cache(
+    filename: str,
+    key: tuple[int, int, int],
+    value: tuple[dict[str, Symbol], dict[str, Action], dict[str, Pipeline]],
+) -> None:
+    symbols, actions, pipelines = value
+    cached = {
+        "key": list(key),
+        "symbols": {k: _dump_symbol(v) for k, v in symbols.items()},
+        "actions": {k: asdict(replace(v, fn=None)) for k, v in actions.items()},
+        "pipelines": {k: asdict(v) for k, v in pipelines.items()},
+    }
+    tmp = f"{filename}.{os.getpid()}.tmp"
+    try:
+        with open(tmp, "w") as f:
+            json.dump(cached, f)
+        os.replace(tmp, filename)
+    except (OSError, TypeError, ValueError):
+        try:
+            os.unlink(tmp)
+        except OSError:
+            pass
+
+
+def _dump_symbol(symbol: Symbol) -> dict[str, Any]:
+    d = asdict(symbol)
+    start = symbol.start
+    if start is not None and isinstance(start.tzinfo, ZoneInfo):
+        d["start"], d["zone"] = start.replace(tzinfo=None).isoformat(), start.tzinfo.key
+    elif start is not None:
+        d["start"] = start.isoformat()
+    return d
+
+
+def _load_symbol(d: dict[str, Any]) -> Symbol:
+    zone, start = d.pop("zone", None), d.pop("start", None)
+    symbol = Symbol(**d)
+    if start is not None:
+        symbol.start = datetime.datetime.fromisoformat(start)
+        if zone is not None:
+            symbol.start = symbol.start.replace(tzinfo=ZoneInfo(zone))
+    return symbol
+
+
 def _walk_symbols(
     node: Iterable[Mapping[str, object]] | None,
     symbol: Symbol | None = None,
@@ -94,6 +192,14 @@ def _walk_symbols(
                         symbol.start = v
                     else:
                         raise TypeError
+                case "intervals":
+                    symbol.intervals = _intervals(v)
+                case "scale":
+                    if type(v) != int:
+                        raise TypeError
+                    if not 0 <= v <= 18:
+                        raise Error(f"bad scale: {v}")
+                    symbol.scale = v
                 case _:
                     raise Error(f"unexpected key: {k}")
         if symbol.start is not None and symbol.start.tzinfo is None:
@@ -131,6 +237,30 @@ def _walk_actions(
                     if type(v) != str:
                         raise TypeError
                     action.using = v
+                case "format":
+                    if type(v) != str:
+                        raise TypeError
+                    if v not in ("csv", "parquet", "ipc"):
+                        raise Error(f"unknown format: {v}")
+                    action.format = v
+                case "writers":
+                    if type(v) != int:
+                        raise TypeError
+                    if v < 0:
+                        raise Error(f"bad number of writers: {v}")
+                    action.writers = v
+                case "merge":
+                    if type(v) != bool:
+                        raise TypeError
+                    action.merge = v
+                case "intervals":
+                    action.intervals = _intervals(v)
+                case "log":
+                    if type(v) != str:
+                        raise TypeError
+                    if v not in ("csv", "ipc"):
+                        raise Error(f"unknown log format: {v}")
+                    action.log = v
                 case _:
                     raise Error(f"unexpected key: {k}")
         if name is not None:
@@ -141,3 +271,105 @@ def _walk_actions(
             if not isinstance(actions, Iterable):
                 raise TypeError
             yield from _walk_actions(actions, replace(action))
+
+
+def _walk_pipelines(node: Iterable[Mapping[str, object]] | None) -> Iterator[Pipeline]:
+    if node is None:
+        return
+    for item in node:
+        pipeline = Pipeline("")
+        for k, v in item.items():
+            match k:
+                case "name":
+                    if type(v) != str:
+                        raise TypeError
+                    pipeline.name = v
+                case "jobs":
+                    if type(v) != int:
+                        raise TypeError
+                    if v < 0:
+                        raise Error(f"bad number of jobs: {v}")
+                    pipeline.jobs = v
+                case "steps":
+                    if not isinstance(v, Iterable):
+                        raise TypeError
+                    pipeline.steps = list(_walk_steps(v))
+                case _:
+                    raise Error(f"unexpected key: {k}")
+        if not pipeline.name:
+            raise Error("pipeline without name")
+        if not pipeline.steps:
+            raise Error(f"no steps in pipeline: {pipeline.name}")
+        names = set()
+        for step in pipeline.steps:
+            if step.name in names:
+                raise Error(f"duplicate step in pipeline {pipeline.name}: {step.name}")
+            names.add(step.name)
+        for step in pipeline.steps:
+            for dep in step.after:
+                if dep not in names:
+                    raise Error(f"unknown step in pipeline {pipeline.name}: {dep}")
+        if len(_order(pipeline.steps)) != len(pipeline.steps):
+            raise Error(f"dependency cycle in pipeline: {pipeline.name}")
+        yield pipeline
+
+
+def _walk_steps(node: Iterable[Mapping[str, object]]) -> Iterator[Step]:
+    for item in node:
+        step = Step("", "")
+        for k, v in item.items():
+            match k:
+                case "name" | "run" | "path":
+                    if type(v) != str:
+                        raise TypeError
+                    setattr(step, k, v)
+                case "args" | "after":
+                    setattr(step, k, _strings(v))
+                case _:
+                    raise Error(f"unexpected key: {k}")
+        if not step.run:
+            raise Error(f"step without action: {step.name}")
+        if not step.name:
+            step.name = step.run
+        yield step
+
+
+def _order(steps: list[Step]) -> list[Step]:
+    done: set[str] = set()
+    order: list[Step] = []
+    while len(order) < len(steps):
+        ready = [s for s in steps if s.name not in done and all(d in done for d in s.after)]
+        if not ready:
+            break
+        order.extend(ready)
+        done.update(s.name for s in ready)
+    return order
+
+
+def _strings(node: object) -> list[str]:
+    if isinstance(node, str):
+        node = [node]
+    if not isinstance(node, list):
+        raise TypeError
+    for v in node:
+        if type(v) != str:
+            raise TypeError
+    return node
+
+
+def _intervals(node: object) -> list[str]:
+    if isinstance(node, str):
+        node = [node]
+    if not isinstance(node, list) or not node:
+        raise TypeError
+    for v in node:
+        if type(v) != str:
+            raise TypeError
+        if re.fullmatch(r"[1-9][0-9]*[smhd]", v) is None:
+            raise Error(f"bad interval: {v}")
+    intervals = sorted(set(node), key=seconds)
+    base = seconds(intervals[0])
+    for v in intervals[1:]:
+        if seconds(v) % base != 0 or (seconds(v) >= 86400 and 3600 % base != 0):
+            raise Error(f"interval {v} is not a multiple of {intervals[0]}")
+    return intervals
@@ -1,7 +1,15 @@
 import datetime
+import filecmp
+import hashlib
+import json
 import os
-from dataclasses import dataclass
+import tempfile
+import threading
+from collections.abc import Sequence
+from concurrent.futures import Future, ThreadPoolExecutor
+from dataclasses import asdict, dataclass, replace
 from pathlib import Path
+from typing import IO, cast
 
 import polars as pl
 
@@ -14,45 +22,533 @@ class Block:
     market: str | None
     start: datetime.date
     records: pl.DataFrame
+    source: str | None = None
+    interval: str | None = None
 
     def __post_init__(self) -> None:
         assert self.records.width > 0
         assert self.records.dtypes[0] == pl.Datetime
 
 
+@dataclass
+class Entry:
+    symbol: str
+    market: str | None
+    month: str
+    format: str
+    hash: str
+    rows: int
+    start: str | None
+    end: str | None
+    size: int
+    source: str | None = None
+    columns: list[str] | None = None
+    time_zone: str | None = None
+    interval: str | None = None
+    appended: bool = False
+
+
+FORMATS = {"csv": "csv", "parquet": "parquet", "ipc": "arrow"}
+
+CATALOG = ".catalog.json"
+
+
 class Store:
-    def __init__(self, path: str | os.PathLike[str]):
+    def __init__(
+        self,
+        path: str | os.PathLike[str],
+        format: str | None = None,
+        writers: int | None = None,
+        merge: bool | None = None,
+    ):
         self._path = Path(path)
+        self._format = format if format is not None else "csv"
+        assert self._format in FORMATS
+        self._merge = bool(merge)
+        self._catalog: dict[str, Entry] | None = None
+        self._dirty: set[str] = set()
+        self._lock = threading.Lock()
+        self._pool: ThreadPoolExecutor | None = None
+        self._slots: threading.BoundedSemaphore | None = None
+        self._pending: dict[Path, Future[Exception | None]] = {}
+        self._err: Exception | None = None
+        if writers:
+            self._pool = ThreadPoolExecutor(writers, thread_name_prefix="store")
+            self._slots = threading.BoundedSemaphore(2 * writers)
+
+    @property
+    def path(self) -> Path:
+        return self._path
+
+    @property
+    def format(self) -> str:
+        return self._format
 
     def put(self, block: Block) -> Exception | None:
-        df = block.records.clone()
+        if self._pool is None:
+            return self._put(block)
+        assert self._slots is not None
+        if self._err is not None:
+            return self._err
+        self._slots.acquire()
+        path = self._month_path(block)
+        prev = self._pending.get(path)
+        if prev is not None:
+            prev.exception()
+        fut = self._pool.submit(self._put, block)
+        with self._lock:
+            self._pending[path] = fut
+        fut.add_done_callback(lambda f: self._done(path, f))
+        return self._err
+
+    def _done(self, path: Path, fut: "Future[Exception | None]") -> None:
+        assert self._slots is not None
+        err = fut.exception()
+        if err is None:
+            err = fut.result()
+        elif not isinstance(err, Exception):
+            err = RuntimeError(err)
+        with self._lock:
+            if self._pending.get(path) is fut:
+                del self._pending[path]
+            if err is not None and self._err is None:
+                self._err = err
+        self._slots.release()
+
+    def _put(self, block: Block) -> Exception | None:
+        if self._merge:
+            merged, err = self._merge_block(block)
+            if err is not None or merged is None:
+                return err
+            block = merged
+        df, err = self._encode(block)
+        if err is not None:
+            return err
+        return self._store(block, df)
+
+    def _encode(self, block: Block) -> tuple[pl.DataFrame, Exception | None]:
+        df = block.records
 
         if block.market:
             sym = f"{block.market}:{block.symbol}"
         else:
             sym = block.symbol
 
-        df = df.with_columns(
-            pl.lit(sym).alias("Symbol"),
-            pl.col(df.columns[0]).map_elements(ts, return_dtype=pl.Utf8).alias(df.columns[0]),
+        if self._format == "csv":
+            df = df.select(
+                pl.lit(sym).alias("Symbol"),
+                format_ts(df.columns[0], df.dtypes[0]),
+                *df.columns[1:],
+            )
+        else:
+            try:
+                df = df.select(
+                    pl.lit(sym).alias("Symbol"),
+                    df.columns[0],
+                    *[pl.col(c).cast(pl.Float64) if df[c].dtype == pl.Utf8 else c for c in df.columns[1:]],
+                )
+            except pl.exceptions.PolarsError as err:
+                return df, err
+        return df, None
+
+    def _merge_block(self, block: Block) -> tuple[Block | None, Exception | None]:
+        path = self._month_path(block)
+        key = path.relative_to(self._path).as_posix()
+        with self._lock:
+            entry = self._load().get(key)
+        dt, dtype = block.records.columns[0], block.records.dtypes[0]
+        t = block.records.get_column(dt)
+        lo, hi = t.min(), t.max()
+        assert isinstance(lo, datetime.datetime) and isinstance(hi, datetime.datetime)
+        first = _utc(lo)
+        assert first is not None
+        try:
+            if not path.exists():
+                return block, None
+            if (
+                self._format == "csv"
+                and entry is not None
+                and entry.columns == ["Symbol", *block.records.columns]
+                and entry.size == path.stat().st_size
+            ):
+                offset = _tail_offset(path, first, entry.size)
+                if offset > 0:
+                    return None, self._splice(block, key, entry, offset)
+            df = self._read_month(path, block).filter(
+                ~pl.col(dt).is_between(pl.lit(lo, dtype=dtype), pl.lit(hi, dtype=dtype))
+            )
+            df = pl.concat([df, block.records]).sort(dt, maintain_order=True)
+        except (OSError, ValueError, pl.exceptions.PolarsError) as err:
+            return None, err
+        return replace(block, records=df), None
+
+    def _splice(self, block: Block, key: str, entry: Entry, offset: int) -> Exception | None:
+        dt, dtype = block.records.columns[0], block.records.dtypes[0]
+        hi = block.records.get_column(dt).max()
+        with open(self._path / key, "r+b") as f:
+            f.seek(offset)
+            tail = f.read()
+            df, replaced = block.records, 0
+            if tail:
+                old = self._read_month(tail, block)
+                df, replaced = pl.concat([df, old.filter(pl.col(dt) > pl.lit(hi, dtype=dtype))]), old.height
+            enc, err = self._encode(replace(block, records=df))
+            if err is not None:
+                return err
+            f.seek(offset)
+            f.truncate()
+            sink = _Sink(f)
+            try:
+                self._write(enc, cast(IO[bytes], sink))
+                f.flush()
+                os.fsync(f.fileno())
+            except BaseException:
+                f.seek(offset)
+                f.truncate()
+                f.write(tail)
+                f.flush()
+                raise
+        end = df.get_column(dt).max()
+        assert isinstance(end, datetime.datetime)
+        entry = replace(
+            entry,
+            hash="",
+            rows=entry.rows - replaced + enc.height,
+            end=ts(end),
+            size=offset + sink.size,
+            source=block.source,
+            appended=True,
         )
-        df = df.select(["Symbol", *[c for c in df.columns if c != "Symbol"]])
-        return self._store(block, df)
+        with self._lock:
+            self._load()[key] = entry
+            self._dirty.add(key)
+        return None
+
+    def _read_month(self, source: Path | bytes, block: Block) -> pl.DataFrame:
+        dt, dtype = block.records.columns[0], block.records.dtypes[0]
+        match self._format:
+            case "csv":
+                df = pl.read_csv(
+                    source,
+                    has_header=False,
+                    new_columns=["Symbol", *block.records.columns],
+                    infer_schema=False,
+                ).with_columns(pl.col(dt).str.to_datetime("%Y-%m-%dT%H:%M:%S%#z", time_zone="UTC"))
+            case "parquet":
+                df = pl.read_parquet(source)
+            case "ipc":
+                df = pl.read_ipc(source, memory_map=False)
+        tz = getattr(dtype, "time_zone", None)
+        return df.select(
+            (
+                pl.col(dt).dt.convert_time_zone(tz)
+                if tz is not None
+                else pl.col(dt).dt.convert_time_zone("UTC").dt.replace_time_zone(None)
+            ).cast(dtype),
+            *[pl.col(c).cast(block.records.schema[c]) for c in block.records.columns[1:]],
+        )
+
+    def entries(
+        self,
+        symbol: str | None = None,
+        market: str | None = None,
+        year: int | None = None,
+    ) -> list[Entry]:
+        catalog = self._load()
+        return [
+            entry
+            for _, entry in sorted(catalog.items())
+            if (symbol is None or entry.symbol.lower() == symbol.lower())
+            and (market is None or (entry.market or "").lower() == market.lower())
+            and (year is None or entry.month.startswith(f"{year:04d}-"))
+        ]
+
+    def scan(
+        self,
+        symbol: str,
+        market: str | None = None,
+        start: datetime.date | None = None,
+        end: datetime.date | None = None,
+        columns: Sequence[str] | None = None,
+        interval: str | None = None,
+    ) -> tuple[pl.LazyFrame | None, Exception | None]:
+        with self._lock:
+            catalog = self._load()
+        lo, hi = _utc(start), _utc(end)
+        prefix = f"{market.lower()}.{symbol.lower()}." if market is not None else f"{symbol.lower()}."
+        pattern = f"[0-9]*/[0-9][0-9]/{prefix}{'[0-9]' * 6}.{FORMATS[self._format]}"
+        root = self._path / interval if interval is not None else self._path
+        files: list[Path] = []
+        entry: Entry | None = None
+        for path in sorted(root.glob(pattern)):
+            e = catalog.get(path.relative_to(self._path).as_posix())
+            if e is not None and e.start is not None and e.end is not None:
+                first, last = datetime.datetime.fromisoformat(e.start), datetime.datetime.fromisoformat(
+                    e.end
+                )
+            else:
+                month = datetime.datetime.strptime(path.name[len(prefix) :][:6], "%Y%m")
+                month = month.replace(tzinfo=datetime.timezone.utc)
+                first, last = month - datetime.timedelta(days=31), month + datetime.timedelta(days=62)
+            if (lo is None or last >= lo) and (hi is None or first < hi):
+                files.append(path)
+                if e is not None and e.columns is not None:
+                    entry = e
+        if not files:
+            return None, None
+
+        names = entry.columns if entry is not None else None
+        dt = names[1] if names is not None else "dt"
+        try:
+            match self._format:
+                case "csv":
+                    lf = pl.scan_csv(files, has_header=False, new_columns=names, infer_schema=False)
+                    if names is None:
+                        lf = lf.rename(dict(zip(lf.collect_schema().names()[:2], ["Symbol", dt])))
+                    lf = lf.with_columns(
+                        pl.col(dt).str.to_datetime("%Y-%m-%dT%H:%M:%S%#z", time_zone="UTC")
+                    )
+                    if entry is not None and entry.time_zone is None:
+                        lf = lf.with_columns(pl.col(dt).dt.replace_time_zone(None))
+                    elif entry is not None and entry.time_zone is not None and entry.time_zone != "UTC":
+                        lf = lf.with_columns(pl.col(dt).dt.convert_time_zone(entry.time_zone))
+                case "parquet":
+                    lf = pl.scan_parquet(files)
+                case "ipc":
+                    lf = pl.scan_ipc(files, memory_map=True)
+            time_zone = getattr(lf.collect_schema()[dt], "time_zone", None)
+        except (OSError, pl.exceptions.PolarsError) as err:
+            return None, err
+
+        def bound(t: datetime.datetime) -> pl.Expr:
+            if time_zone is None:
+                return pl.lit(t.replace(tzinfo=None))
+            return pl.lit(t).dt.convert_time_zone(time_zone)
+
+        if lo is not None:
+            lf = lf.filter(pl.col(dt) >= bound(lo))
+        if hi is not None:
+            lf = lf.filter(pl.col(dt) < bound(hi))
+        if columns is not None:
+            lf = lf.select(columns)
+        return lf, None
+
+    def close(self) -> Exception | None:
+        self._drain()
+        err = self._close()
+        return self._err if self._err is not None else err
+
+    def flush(self) -> Exception | None:
+        if self._pool is None:
+            return self._err
+        with self._lock:
+            pending = list(self._pending.values())
+        for fut in pending:
+            err = fut.exception()
+            if err is None:
+                err = fut.result()
+            if err is not None and self._err is None:
+                return err if isinstance(err, Exception) else RuntimeError(err)
+        return self._err
+
+    def detach(self) -> tuple[dict[str, Entry], Exception | None]:
+        self._drain()
+        with self._lock:
+            catalog = self._load()
+            entries = {key: catalog[key] for key in self._dirty}
+            self._dirty = set()
+        return entries, self._err
+
+    def attach(self, entries: dict[str, Entry]) -> None:
+        with self._lock:
+            self._load().update(entries)
+            self._dirty.update(entries)
+
+    def _drain(self) -> None:
+        if self._pool is not None:
+            self._pool.shutdown(wait=True)
+            self._pool = None
+
+    def _close(self) -> Exception | None:
+        if not self._dirty:
+            return None
+        assert self._catalog is not None
+        try:
+            catalog = self._read_catalog()
+            for key in self._dirty:
+                catalog[key] = self._catalog[key]
+            path = self._path / CATALOG
+            fd, tmp = tempfile.mkstemp(prefix=f"{CATALOG}.", dir=self._path)
+            try:
+                with os.fdopen(fd, "w") as f:
+                    json.dump({k: asdict(v) for k, v in sorted(catalog.items())}, f, indent=1)
+                os.chmod(tmp, 0o644)
+                os.replace(tmp, path)
+            finally:
+                if os.path.exists(tmp):
+                    os.unlink(tmp)
+            self._catalog, self._dirty = catalog, set()
+            return None
+        except (OSError, ValueError, TypeError) as err:
+            return err
 
     def _store(self, block: Block, df: pl.DataFrame) -> Exception | None:
         try:
-            csv = df.write_csv(None, include_header=False, line_terminator="\n").encode()
-            path = self._path / f"{block.start.year}" / f"{block.start.month:02d}"
-            path.mkdir(mode=0o755, parents=True, exist_ok=True)
-            path = path / self._make_filename(block.symbol, block.market, block.start)
-            if not path.exists() or csv != path.read_bytes():
-                path.write_bytes(csv)
+            with self._lock:
+                catalog = self._load()
+            path = self._month_path(block)
+            path.parent.mkdir(mode=0o755, parents=True, exist_ok=True)
+            key = path.relative_to(self._path).as_posix()
+            fd, tmp = tempfile.mkstemp(prefix=f".{path.name}.", dir=path.parent)
+            try:
+                with os.fdopen(fd, "wb") as f:
+                    sink = _Sink(f)
+                    self._write(df, cast(IO[bytes], sink))
+                    f.flush()
+                    with self._lock:
+                        entry = catalog.get(key)
+                    if not path.exists():
+                        changed = True
+                    elif entry is not None and not entry.appended:
+                        changed = entry.hash != sink.hexdigest() or entry.size != path.stat().st_size
+                    else:
+                        changed = not filecmp.cmp(tmp, path, shallow=False)
+                    if changed:
+                        os.fsync(f.fileno())
+                if changed:
+                    os.chmod(tmp, 0o644)
+                    os.replace(tmp, path)
+            finally:
+                if os.path.exists(tmp):
+                    os.unlink(tmp)
+            t = block.records.get_column(block.records.columns[0])
+            start, end = t.min(), t.max()
+            entry = Entry(
+                symbol=block.symbol,
+                market=block.market,
+                month=block.start.strftime("%Y-%m"),
+                format=self._format,
+                hash=sink.hexdigest(),
+                rows=df.height,
+                start=ts(start) if isinstance(start, datetime.datetime) else None,
+                end=ts(end) if isinstance(end, datetime.datetime) else None,
+                size=sink.size,
+                source=block.source,
+                columns=df.columns,
+                time_zone=getattr(block.records.dtypes[0], "time_zone", None),
+                interval=block.interval,
+            )
+            with self._lock:
+                catalog[key] = entry
+                self._dirty.add(key)
             return None
         except OSError as err:
             return err
 
-    @staticmethod
-    def _make_filename(symbol: str, market: str | None, start: datetime.date) -> str:
+    def _write(self, df: pl.DataFrame, f: IO[bytes]) -> None:
+        match self._format:
+            case "csv":
+                df.write_csv(f, include_header=False, line_terminator="\n")
+            case "parquet":
+                df.write_parquet(f, compression="zstd")
+            case "ipc":
+                df.write_ipc(f, compression="uncompressed")
+
+    def _load(self) -> dict[str, Entry]:
+        if self._catalog is None:
+            try:
+                self._catalog = self._read_catalog()
+            except (OSError, ValueError, TypeError):
+                self._catalog = {}
+        return self._catalog
+
+    def _read_catalog(self) -> dict[str, Entry]:
+        try:
+            with open(self._path / CATALOG, "r") as f:
+                co = json.load(f)
+        except FileNotFoundError:
+            return {}
+        return {k: Entry(**v) for k, v in co.items()}
+
+    def _month_path(self, block: Block) -> Path:
+        return (
+            (self._path / block.interval if block.interval is not None else self._path)
+            / f"{block.start.year}"
+            / f"{block.start.month:02d}"
+            / self._make_filename(block.symbol, block.market, block.start)
+        )
+
+    def _make_filename(self, symbol: str, market: str | None, start: datetime.date) -> str:
+        ext = FORMATS[self._format]
         if market is not None:
-            return f"{market.lower()}.{symbol.lower()}.{start.strftime('%Y%m')}.csv"
-        return f"{symbol.lower()}.{start.strftime('%Y%m')}.csv"
+            return f"{market.lower()}.{symbol.lower()}.{start.strftime('%Y%m')}.{ext}"
+        return f"{symbol.lower()}.{start.strftime('%Y%m')}.{ext}"
+
+
+class _Sink:
+    def __init__(self, f: IO[bytes]):
+        self._f, self._h, self.size = f, hashlib.blake2b(digest_size=16), 0
+
+    def write(self, b: bytes) -> int:
+        self._h.update(b)
+        self.size += len(b)
+        return self._f.write(b)
+
+    def flush(self) -> None:
+        self._f.flush()
+
+    def hexdigest(self) -> str:
+        return self._h.hexdigest()
+
+
+def _tail_offset(path: Path, t: datetime.datetime, size: int) -> int:
+    off = size
+    with open(path, "rb") as f:
+        buf, base = b"", size
+        while off > 0:
+            nl = buf.rfind(b"\n", 0, off - base - 1)
+            while nl < 0 and base > 0:
+                n = min(base, 1 << 16)
+                f.seek(base - n)
+                buf, base = f.read(n) + buf, base - n
+                nl = buf.rfind(b"\n", 0, off - base - 1)
+            start = base + nl + 1
+            line = buf[start - base : off - base - 1]
+            row = _utc(datetime.datetime.fromisoformat(line.split(b",", 2)[1].decode()))
+            assert row is not None
+            if row < t:
+                return off
+            off, buf = start, buf[: start - base]
+    return 0
+
+
+def _utc(t: datetime.date | None) -> datetime.datetime | None:
+    if t is None:
+        return None
+    if not isinstance(t, datetime.datetime):
+        t = datetime.datetime.combine(t, datetime.time.min)
+    if t.tzinfo is None:
+        return t.replace(tzinfo=datetime.timezone.utc)
+    return t.astimezone(datetime.timezone.utc)
+
+
+def fingerprint(path: str | os.PathLike[str]) -> str | None:
+    try:
+        st = os.stat(path)
+    except OSError:
+        return None
+    return f"{Path(path).name}:{st.st_size}:{st.st_mtime_ns}"
+
+
+def format_ts(name: str, dtype: pl.DataType) -> pl.Expr:
+    col = pl.col(name)
+    utc = col.dt.strftime("%Y-%m-%dT%H:%M:%SZ")
+    time_zone = getattr(dtype, "time_zone", None)
+    if time_zone is None or time_zone == "UTC":
+        return utc.alias(name)
+    return (
+        pl.when(col.dt.strftime("%Z").is_in(["GMT", "UTC"]))
+        .then(utc)
+        .otherwise(col.dt.strftime("%Y-%m-%dT%H:%M:%S%:z"))
+        .alias(name)
+    )
@@ -0,0 +1,436 @@
+import contextlib
+import datetime
+import gzip
+import io
+import os
+import time
+import zipfile
+from abc import abstractmethod
+from collections.abc import Callable, Iterator, Sequence
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from dataclasses import replace
+from pathlib import Path
+from typing import IO, cast
+
+import polars as pl
+
+import watch
+from common import Action, Cmd, Symbol, p, parse_jobs
+from fs import Entry, Store
+
+SCALE = 8
+COMPRESSED = (".zip", ".gz", ".zst")
+
+
+class Import(Cmd):
+    def run(self, *args, **kwargs) -> tuple[int | None, str | Exception | None]:
+        symbols: dict[str, Symbol] | None = kwargs.get("symbols")
+        if not symbols:
+            return None, None
+        path: str | os.PathLike[str] | None = kwargs.get("path")
+        path = path if path is not None else ""
+        action: Action | None = kwargs.get("action")
+        jobs, files, jobs_err = parse_jobs(args)
+        if jobs_err is not None:
+            return 1, jobs_err
+
+        todo: list[tuple[str, Symbol]] = []
+        for arg in files:
+            symbol, parse_err = self._symbol(arg, symbols, action)
+            if parse_err is not None:
+                return 1, parse_err
+            if symbol is None:
+                p(f"Skipping {arg}")
+                continue
+            todo.append((arg, symbol))
+
+        store = open_store(path, action)
+        if jobs > 1 and action is not None and action.merge:
+            p("Merging into existing months, ignoring --jobs")
+            jobs = 1
+        if jobs > 1 and len(todo) > 1:
+            return self._run_parallel(todo, path, action, store, jobs)
+
+        for arg, symbol in todo:
+            p(f"Processing {arg}... ", end="")
+            err = self._process_arg(arg, symbol, store)
+            if err is not None:
+                p()
+                store.close()
+                return 2, err
+            p("done.")
+        store_err = store.close()
+        if store_err is not None:
+            return 2, store_err
+        return None, None
+
+    def _run_parallel(
+        self,
+        todo: list[tuple[str, Symbol]],
+        path: str | os.PathLike[str],
+        action: Action | None,
+        store: Store,
+        jobs: int,
+    ) -> tuple[int | None, str | Exception | None]:
+        if action is not None:
+            action = replace(action, fn=None)
+        failed = 0
+        with ProcessPoolExecutor(min(jobs, len(todo))) as pool:
+            futures = {
+                pool.submit(_import, type(self), arg, symbol, path, action): arg for arg, symbol in todo
+            }
+            for future in as_completed(futures):
+                arg = futures[future]
+                try:
+                    entries, err = future.result()
+                except Exception as e:
+                    entries, err = {}, e
+                store.attach(entries)
+                if err is not None:
+                    p(f"Processing {arg}... failed: {err}")
+                    failed += 1
+                else:
+                    p(f"Processing {arg}... done.")
+        err = store.close()
+        if err is not None:
+            return 2, err
+        if failed:
+            return 2, f"{failed} of {len(todo)} files failed"
+        return None, None
+
+    def _symbol(
+        self, arg: str, symbols: dict[str, Symbol], action: Action | None
+    ) -> tuple[Symbol | None, Exception | None]:
+        sym, err = self._parse_arg(arg)
+        if err is not None:
+            return None, err
+        if sym.lower() not in symbols:
+            return None, None
+        symbol = symbols[sym.lower()]
+        if symbol.intervals is None and action is not None and action.intervals is not None:
+            symbol = replace(symbol, intervals=action.intervals)
+        return symbol, None
+
+    @staticmethod
+    @abstractmethod
+    def _parse_arg(arg: str) -> tuple[str, Exception | None]: ...
+
+    @staticmethod
+    @abstractmethod
+    def _process_arg(arg: str, symbol: Symbol, store: Store) -> str | Exception | None: ...
+
+
+class Watch(Cmd):
+    def __init__(self, importer: Import) -> None:
+        self._import = importer
+        self._failed: dict[str, tuple[int, int]] = {}
+        self._skipped: set[str] = set()
+
+    def run(self, *args, **kwargs) -> tuple[int | None, str | Exception | None]:
+        symbols: dict[str, Symbol] | None = kwargs.get("symbols")
+        if not symbols:
+            return None, None
+        path: str | os.PathLike[str] | None = kwargs.get("path")
+        path = path if path is not None else ""
+        action: Action | None = kwargs.get("action")
+        settle, interval, once, rest, err = watch.parse_watch(args)
+        if err is not None:
+            return 1, err
+        if not rest:
+            return 1, "drop path?"
+        drop = Path(rest[0])
+        if not drop.is_dir():
+            return 1, f"not a directory: {drop}"
+
+        name = action.name if action is not None else "watch"
+        ledger = watch.Ledger(Path(path, f".prep.{name}.ledger"))
+        watcher = watch.open_watcher(drop, interval)
+        if not once:
+            p(f"Watching {drop}...")
+        try:
+            while True:
+                due, wait = self._scan(drop, ledger, symbols, action, settle)
+                if due:
+                    store_err = self._process(due, ledger, path, action)
+                    if store_err is not None:
+                        return 2, store_err
+                if once and wait is None:
+                    break
+                watcher.wait(wait)
+        finally:
+            watcher.close()
+        if self._failed:
+            return 2, f"{len(self._failed)} files failed"
+        return None, None
+
+    def _scan(
+        self,
+        drop: Path,
+        ledger: watch.Ledger,
+        symbols: dict[str, Symbol],
+        action: Action | None,
+        settle: float,
+    ) -> tuple[list[tuple[str, Symbol, watch.Seen]], float | None]:
+        due: list[tuple[str, Symbol, watch.Seen]] = []
+        wait: float | None = None
+        now = time.time()
+        for entry in sorted(os.scandir(drop), key=lambda e: e.name):
+            if entry.name.startswith(".") or not entry.is_file():
+                continue
+            arg = os.path.abspath(entry.path)
+            if arg in self._skipped:
+                continue
+            try:
+                st = entry.stat()
+            except OSError:
+                continue
+            seen = ledger.get(arg)
+            if seen is not None and (seen.size, seen.mtime_ns) == (st.st_size, st.st_mtime_ns):
+                continue
+            if self._failed.get(arg) == (st.st_size, st.st_mtime_ns):
+                continue
+            age = now - st.st_mtime
+            if age < settle:
+                wait = settle - age if wait is None else min(wait, settle - age)
+                continue
+            symbol, parse_err = self._import._symbol(arg, symbols, action)
+            if symbol is None:
+                p(f"Skipping {arg}" if parse_err is None else f"Skipping {arg}: {parse_err}")
+                self._skipped.add(arg)
+                continue
+            sha256, digest_err = watch.digest(arg)
+            if digest_err is not None:
+                continue
+            if seen is not None and seen.sha256 == sha256:
+                ledger.put(arg, watch.Seen(st.st_size, st.st_mtime_ns, sha256))
+                continue
+            due.append((arg, symbol, watch.Seen(st.st_size, st.st_mtime_ns, sha256)))
+        return due, wait
+
+    def _process(
+        self,
+        due: list[tuple[str, Symbol, watch.Seen]],
+        ledger: watch.Ledger,
+        path: str | os.PathLike[str],
+        action: Action | None,
+    ) -> Exception | None:
+        store, done = open_store(path, action), []
+        try:
+            for arg, symbol, seen in due:
+                p(f"Processing {arg}... ", end="")
+                err = self._import._process_arg(arg, symbol, store)
+                if err is not None:
+                    p(f"failed: {err}")
+                    self._failed[arg] = (seen.size, seen.mtime_ns)
+                    continue
+                p("done.")
+                self._failed.pop(arg, None)
+                done.append((arg, seen))
+        finally:
+            store_err = store.close()
+        if store_err is not None:
+            return store_err
+        for arg, seen in done:
+            ledger_err = ledger.put(arg, seen)
+            if ledger_err is not None:
+                return ledger_err
+        return None
+
+
+def _import(
+    cls: type[Import],
+    arg: str,
+    symbol: Symbol,
+    path: str | os.PathLike[str],
+    action: Action | None,
+) -> tuple[dict[str, Entry], str | Exception | None]:
+    store = open_store(path, action)
+    err = cls._process_arg(arg, symbol, store)
+    entries, store_err = store.detach()
+    return entries, err if err is not None else store_err
+
+
+def open_store(path: str | os.PathLike[str], action: Action | None) -> Store:
+    if action is None:
+        return Store(path)
+    return Store(path, action.format, action.writers, action.merge)
+
+
+class Months:
+    def __init__(self, emit: Callable[[datetime.date, pl.DataFrame], Exception | None], key: str = "dt"):
+        self._emit, self._key = emit, key
+        self._month: int | None = None
+        self._chunks: list[pl.DataFrame] = []
+
+    def push(self, batch: pl.DataFrame) -> Exception | None:
+        if batch.height == 0:
+            return None
+        try:
+            if batch.schema[self._key].is_integer():
+                months = batch.get_column(self._key)
+            else:
+                months = batch.select(
+                    pl.col(self._key).dt.year() * 12 + pl.col(self._key).dt.month() - 1
+                ).to_series()
+            starts = (months != months.shift(1)).fill_null(True).arg_true().to_list()
+        except pl.exceptions.PolarsError as err:
+            return err
+        for i, start in enumerate(starts):
+            stop = starts[i + 1] if i + 1 < len(starts) else batch.height
+            month = months[start]
+            if month != self._month:
+                err_ = self._flush()
+                if err_ is not None:
+                    return err_
+                self._month = month
+            self._chunks.append(batch.slice(start, stop - start))
+        return None
+
+    def close(self) -> Exception | None:
+        return self._flush()
+
+    def _flush(self) -> Exception | None:
+        if not self._chunks:
+            return None
+        assert self._month is not None
+        df, self._chunks = pl.concat(self._chunks), []
+        return self._emit(datetime.date(self._month // 12, self._month % 12 + 1, 1), df)
+
+
+class Bars:
+    def __init__(
+        self,
+        every: str,
+        aggregate: Callable[[pl.DataFrame], pl.DataFrame],
+        emit: Callable[[pl.DataFrame], Exception | None],
+        key: str = "dt",
+        group_by: str | None = None,
+    ):
+        self._every, self._aggregate, self._emit = every, aggregate, emit
+        self._key, self._group_by = key, group_by
+        self._tail: pl.DataFrame | None = None
+
+    def push(self, batch: pl.DataFrame) -> Exception | None:
+        if batch.height == 0:
+            return None
+        df = batch if self._tail is None else pl.concat([self._tail, batch])
+        try:
+            last = pl.col(self._key).dt.truncate(self._every)
+            last = last == last.last()
+            if self._group_by is not None:
+                last = last & (pl.col(self._group_by) == pl.col(self._group_by).last())
+            n = df.select(last.sum()).item()
+            done, self._tail = df.head(df.height - n), df.tail(n)
+            if done.height == 0:
+                return None
+            bars = self._aggregate(done)
+        except pl.exceptions.PolarsError as err:
+            return err
+        return self._emit(bars)
+
+    def close(self) -> Exception | None:
+        if self._tail is None or self._tail.height == 0:
+            return None
+        try:
+            bars, self._tail = self._aggregate(self._tail), None
+        except pl.exceptions.PolarsError as err:
+            return err
+        return self._emit(bars)
+
+
+def read_batches(f: IO[bytes], size: int = 1 << 20, **options) -> Iterator[tuple[int, int, pl.DataFrame]]:
+    offset, rest = f.tell(), b""
+    while True:
+        chunk = f.read(size)
+        if not chunk:
+            return
+        buf = rest + chunk if rest else chunk
+        end = buf.rfind(b"\n") + 1
+        if end == 0:
+            rest = buf
+            continue
+        rest = buf[end:]
+        yield offset, offset + end, pl.read_csv(io.BytesIO(buf[:end]), has_header=False, **options)
+        offset += end
+
+
+def stem(arg: str) -> str:
+    path = Path(arg)
+    if path.suffix in COMPRESSED:
+        path = path.with_suffix("")
+    return path.stem
+
+
+def compressed(arg: str) -> bool:
+    return Path(arg).suffix in COMPRESSED
+
+
+@contextlib.contextmanager
+def open_source(arg: str) -> Iterator[IO[bytes]]:
+    match Path(arg).suffix:
+        case ".zip":
+            with zipfile.ZipFile(arg) as z:
+                names = [i.filename for i in z.infolist() if not i.is_dir()]
+                if len(names) != 1:
+                    raise OSError(f"expected one file in {arg}, found {len(names)}")
+                with z.open(names[0]) as f:
+                    yield f
+        case ".gz":
+            with gzip.open(arg, "rb") as gz:
+                yield cast(IO[bytes], gz)
+        case ".zst":
+            with _open_zstd(arg) as f:
+                yield f
+        case _:
+            with open(arg, "rb") as f:
+                yield f
+
+
+def _open_zstd(arg: str) -> IO[bytes]:
+    try:
+        from compression import zstd  # type: ignore[import-not-found]
+
+        return zstd.open(arg, "rb")
+    except ImportError:
+        pass
+    try:
+        import zstandard  # type: ignore[import-not-found]
+
+        return zstandard.open(arg, "rb")
+    except ImportError:
+        raise OSError(f"cannot read {arg}: zstd needs Python 3.14 or the zstandard package")
+
+
+def rollup(df: pl.DataFrame, every: str, scale: int = SCALE, key: str = "dt") -> pl.DataFrame:
+    aggs: list[pl.Expr] = []
+    for c in df.columns:
+        if c == key:
+            continue
+        col = pl.col(c)
+        match c:
+            case "open":
+                aggs.append(col.first())
+            case "close":
+                aggs.append(col.last())
+            case "high" | "low":
+                value = parse_fixed(c, scale) if df.schema[c] == pl.Utf8 else col
+                best = value.max() if c == "high" else value.min()
+                aggs.append(col.filter(value == best).first())
+            case _:
+                aggs.append(col.sum())
+    return df.group_by_dynamic(index_column=key, every=every, closed="left").agg(aggs)
+
+
+def parse_fixed(name: str, scale: int) -> pl.Expr:
+    return pl.col(name).cast(pl.Decimal(38, scale)).alias(name)
+
+
+def check_fixed(names: Sequence[str], scale: int) -> pl.Expr:
+    return pl.any_horizontal(pl.col(names).str.contains(rf"\.[0-9]{{{scale + 1},}}").any())
+
+
+def format_fixed(name: str, scale: int) -> pl.Expr:
+    value = pl.col(name).cast(pl.Utf8)
+    if scale > 0:
+        value = value.str.strip_chars_end("0").str.strip_chars_end(".")
+    return value.alias(name)
@@ -0,0 +1,115 @@
+import json
+import os
+import subprocess
+import sys
+from collections.abc import Sequence
+from concurrent.futures import Future, ThreadPoolExecutor, wait
+from pathlib import Path
+
+from common import Pipeline, Step, p, parse_jobs
+
+PREP = Path(__file__).resolve().with_name("prep.py")
+
+
+def run(pipeline: Pipeline, path: str, *args: str) -> tuple[int | None, str | Exception | None]:
+    jobs, rest, err = parse_jobs(args, default=pipeline.jobs or os.cpu_count() or 1)
+    if err is not None:
+        return 1, err
+    restart = "--restart" in rest
+    rest = [arg for arg in rest if arg != "--restart"]
+    if rest:
+        return 1, f"unexpected arguments: {' '.join(rest)}"
+
+    statefile = Path(path, f".prep.{pipeline.name}.state")
+    names = {step.name for step in pipeline.steps}
+    done = set() if restart else _load_state(statefile) & names
+    if done:
+        p(f"Resuming {pipeline.name}: {len(done)} of {len(names)} steps done.")
+
+    pending = [step for step in pipeline.steps if step.name not in done]
+    failed: list[str] = []
+    skipped: set[str] = set()
+    running: dict[Future[tuple[int | None, str | Exception | None]], Step] = {}
+
+    with ThreadPoolExecutor(jobs) as pool:
+        while pending or running:
+            for step in _skip(pending, set(failed) | skipped):
+                pending.remove(step)
+                skipped.add(step.name)
+            for step in [s for s in pending if all(d in done for d in s.after)][: jobs - len(running)]:
+                pending.remove(step)
+                p(f"Running {pipeline.name}:{step.name}...")
+                running[pool.submit(_run_step, step, path)] = step
+            if not running:
+                break
+            finished, _ = wait(running, return_when="FIRST_COMPLETED")
+            for future in finished:
+                step = running.pop(future)
+                _, step_err = future.result()
+                if step_err is not None:
+                    p(f"Running {pipeline.name}:{step.name}... failed: {step_err}")
+                    failed.append(step.name)
+                    continue
+                p(f"Running {pipeline.name}:{step.name}... done.")
+                done.add(step.name)
+                state_err = _save_state(statefile, done)
+                if state_err is not None:
+                    p("Warning:", state_err)
+
+    if failed:
+        msg = f"{len(failed)} of {len(names)} steps failed: {', '.join(failed)}"
+        if skipped:
+            msg += f" ({len(skipped)} skipped)"
+        return 2, msg
+    statefile.unlink(missing_ok=True)
+    return None, None
+
+
+def _skip(pending: Sequence[Step], broken: set[str]) -> list[Step]:
+    skip: list[Step] = []
+    while True:
+        more = [s for s in pending if s not in skip and any(d in broken for d in s.after)]
+        if not more:
+            return skip
+        skip.extend(more)
+        broken |= {s.name for s in more}
+
+
+def _run_step(step: Step, path: str) -> tuple[int | None, str | Exception | None]:
+    argv = [
+        sys.executable,
+        str(PREP),
+        str(Path(path, step.path)) if step.path else path,
+        step.run,
+        *step.args,
+    ]
+    try:
+        proc = subprocess.run(argv)
+    except OSError as err:
+        return 2, err
+    if proc.returncode != 0:
+        return proc.returncode, f"exit status {proc.returncode}"
+    return None, None
+
+
+def _load_state(statefile: Path) -> set[str]:
+    try:
+        with open(statefile, "r") as f:
+            state = json.load(f)
+    except (OSError, ValueError):
+        return set()
+    done = state.get("done") if isinstance(state, dict) else None
+    if not isinstance(done, list):
+        return set()
+    return {name for name in done if isinstance(name, str)}
+
+
+def _save_state(statefile: Path, done: set[str]) -> Exception | None:
+    tmp = statefile.with_name(statefile.name + ".tmp")
+    try:
+        with open(tmp, "w") as f:
+            json.dump({"done": sorted(done)}, f)
+        os.replace(tmp, statefile)
+    except OSError as err:
+        return err
+    return None
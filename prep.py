@@ -24,7 +24,7 @@ def main(argv: Sequence[str]) -> tuple[int | None, str | Exception | None]:
     err = conf.load(prepfile)
     if err is not None:
         return 1, err
-    if not conf.symbols() and not conf.actions():
+    if not conf.symbols() and not conf.actions() and not conf.pipelines():
         return 1, "empty prepfile?"
 
     actions: dict[str, Action] = {name: bind(action) for name, action in conf.actions().items()}
@@ -39,9 +39,16 @@ def main(argv: Sequence[str]) -> tuple[int | None, str | Exception | None]:
                 return "\t" + action.name + f"\t({action.using})"
             return "\t" + action.name
 
-        p("\n".join(s(action) for action in actions.values()))
+        lines = [s(action) for action in actions.values()]
+        lines += [f"\t{name}\t(pipeline)" for name in conf.pipelines()]
+        p("\n".join(lines))
         return None, None
 
+    if cmd in conf.pipelines():
+        import pipeline
+
+        return pipeline.run(conf.pipelines()[cmd], path, *argv[3:])
+
     if cmd not in actions:
         p(f"Unknown command: {cmd}")
         return 1, None
@@ -59,7 +66,7 @@ def bind(action: Action) -> Action:
         mod_cmd, err = mod.get_cmd(self.name)
         if err is not None:
             return 2, err
-        return mod_cmd.run(*args, **kwargs)
+        return mod_cmd.run(*args, action=self, **kwargs)
 
     action.fn = run
     return action
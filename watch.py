@@ -0,0 +1,134 @@
+import ctypes
+import hashlib
+import json
+import os
+import select
+import sys
+import time
+from collections.abc import Sequence
+from dataclasses import asdict, dataclass
+from pathlib import Path
+
+IN_MODIFY = 0x002
+IN_CLOSE_WRITE = 0x008
+IN_MOVED_TO = 0x080
+IN_CREATE = 0x100
+IN_MASK = IN_MODIFY | IN_CLOSE_WRITE | IN_MOVED_TO | IN_CREATE
+
+
+class Inotify:
+    _fd: int
+
+    def __init__(self, path: str | os.PathLike[str]) -> None:
+        if sys.platform != "linux":
+            raise OSError(f"inotify is not available on {sys.platform}")
+        libc = ctypes.CDLL(None, use_errno=True)
+        self._fd = libc.inotify_init1(os.O_NONBLOCK | os.O_CLOEXEC)
+        if self._fd < 0:
+            errno = ctypes.get_errno()
+            raise OSError(errno, os.strerror(errno))
+        if libc.inotify_add_watch(self._fd, os.fsencode(path), IN_MASK) < 0:
+            errno = ctypes.get_errno()
+            os.close(self._fd)
+            raise OSError(errno, os.strerror(errno), os.fspath(path))
+
+    def wait(self, timeout: float | None) -> None:
+        ready, _, _ = select.select([self._fd], [], [], timeout)
+        while ready:
+            try:
+                os.read(self._fd, 1 << 16)
+            except BlockingIOError:
+                break
+
+    def close(self) -> None:
+        os.close(self._fd)
+
+
+class Poller:
+    def __init__(self, interval: float) -> None:
+        self._interval = interval
+
+    def wait(self, timeout: float | None) -> None:
+        time.sleep(self._interval if timeout is None else min(timeout, self._interval))
+
+    def close(self) -> None:
+        pass
+
+
+def open_watcher(path: str | os.PathLike[str], interval: float) -> Inotify | Poller:
+    if sys.platform == "linux":
+        try:
+            return Inotify(path)
+        except (OSError, AttributeError):
+            pass
+    return Poller(interval)
+
+
+@dataclass
+class Seen:
+    size: int
+    mtime_ns: int
+    sha256: str
+
+
+class Ledger:
+    def __init__(self, path: str | os.PathLike[str]) -> None:
+        self._path = Path(path)
+        self._files: dict[str, Seen] = {}
+        try:
+            with open(self._path, "r") as f:
+                files = json.load(f)
+            self._files = {name: Seen(**seen) for name, seen in files.items()}
+        except (OSError, ValueError, TypeError, AttributeError):
+            pass
+
+    def get(self, name: str) -> Seen | None:
+        return self._files.get(name)
+
+    def put(self, name: str, seen: Seen) -> Exception | None:
+        self._files[name] = seen
+        tmp = self._path.with_name(self._path.name + ".tmp")
+        try:
+            with open(tmp, "w") as f:
+                json.dump({k: asdict(v) for k, v in sorted(self._files.items())}, f, indent=1)
+            os.replace(tmp, self._path)
+        except OSError as err:
+            return err
+        return None
+
+
+def digest(path: str | os.PathLike[str]) -> tuple[str, Exception | None]:
+    h = hashlib.sha256()
+    try:
+        with open(path, "rb") as f:
+            while chunk := f.read(1 << 20):
+                h.update(chunk)
+    except OSError as err:
+        return "", err
+    return h.hexdigest(), None
+
+
+def parse_watch(args: Sequence[str]) -> tuple[float, float, bool, list[str], str | None]:
+    settle, interval, once, rest = 2.0, 5.0, False, []
+    it = iter(args)
+    for arg in it:
+        if arg in ("--settle", "--interval"):
+            arg = arg + "=" + next(it, "")
+        if arg.startswith(("--settle=", "--interval=")):
+            opt, _, value = arg.partition("=")
+            try:
+                seconds = float(value)
+            except ValueError:
+                return 0, 0, False, [], f"bad {opt.removeprefix('--')}: {arg}"
+            if seconds < 0 or (opt == "--interval" and seconds == 0):
+                return 0, 0, False, [], f"bad {opt.removeprefix('--')}: {value}"
+            if opt == "--settle":
+                settle = seconds
+            else:
+                interval = seconds
+            continue
+        if arg == "--once":
+            once = True
+            continue
+        rest.append(arg)
+    return settle, interval, once, rest, None